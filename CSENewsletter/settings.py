@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -62,23 +64,78 @@ import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Widths (px) of the resized JPEG/PNG + WebP copies made for each upload.
+IMAGE_VARIANT_WIDTHS = {
+    'post': [320, 640, 1080],
+    'user': [64, 128, 256],
+}
+
 SITE_ID = 1
 
 AUTH_USER_MODEL = 'myapp.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        # JWTAuthentication with the user row cached between requests.
+        'myapp.authentication.CachedJWTAuthentication',
+    ),
+    # Cursor pagination for every list endpoint; clients may ask for up to
+    # KeysetPagination.max_page_size items with ?page_size=.
+    'DEFAULT_PAGINATION_CLASS': 'myapp.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', 20)),
 }
 
 from datetime import timedelta
+
+# Background work (notification fan-out, ...) runs on an in-process thread
+# pool after the triggering transaction commits. Set BACKGROUND_TASKS_ASYNC=0
+# to run it inline instead.
+BACKGROUND_TASKS_ASYNC = os.environ.get('BACKGROUND_TASKS_ASYNC', '1') == '1'
+BACKGROUND_TASKS_WORKERS = int(os.environ.get('BACKGROUND_TASKS_WORKERS', 2))
+NOTIFICATION_FANOUT_BATCH_SIZE = 500
+
+# 'push' writes one Notification row per subscriber per post; 'pull' builds
+# notifications from recent posts in followed departments and tracks read
+# state as per-department watermarks. Switch existing data with
+# `manage.py convert_notifications`.
+NOTIFICATION_MODE = os.environ.get('NOTIFICATION_MODE', 'push')
+NOTIFICATION_PULL_WINDOW = timedelta(days=30)
+
+# Ranked feeds (?ordering=top|hot). top = likes * like weight + comments *
+# comment weight; hot = top / (age in hours + 2) ** gravity, refreshed for
+# posts inside the window by `manage.py refresh_hot_scores`.
+POST_SCORE_LIKE_WEIGHT = 1
+POST_SCORE_COMMENT_WEIGHT = 2
+POST_SCORE_GRAVITY = 1.5
+POST_HOT_WINDOW = timedelta(days=7)
+
+# Materialized per-user timeline for /posts/followed/. Turning it on for an
+# existing database needs `manage.py rebuild_timelines` first. Each new
+# post trims its followers' timelines back to the cap, dropping the oldest
+# entries, and the followed feed ends there.
+TIMELINE_ENABLED = os.environ.get('TIMELINE_ENABLED', '0') == '1'
+TIMELINE_MAX_ENTRIES = 1000
+
+# Rows fetched per query by the streaming exports (/export/<kind>/ and
+# `manage.py export_newsletter`).
+EXPORT_CHUNK_SIZE = 2000
+
+# Seconds CachedJWTAuthentication keeps a user; saving the user drops it
+# sooner, but only in the worker that saved it while CACHES is the
+# per-process LocMemCache. Elsewhere a deactivated or demoted user keeps
+# their old access for up to this long, except on views marked
+# `privileged` (metrics, exports, role changes), which always read the
+# user from the database.
+AUTH_USER_CACHE_TIMEOUT = 60
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
 MIDDLEWARE = [
+    'myapp.metrics.PerformanceMiddleware',
+    'myapp.routers.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -154,10 +211,74 @@ WSGI_APPLICATION = 'CSENewsletter.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+    }
+}
+
+# SQLITE_PROFILE=production tunes SQLite for concurrent writers (compare
+# with `manage.py benchmark_sqlite`): WAL so readers don't block the
+# writer, a busy timeout instead of failing at once on a lock, BEGIN
+# IMMEDIATE for atomic() so a transaction never has to upgrade a read lock
+# (which fails regardless of the timeout), and connections kept between
+# requests. Keep CONN_MAX_AGE at 0 for ASGI deployments.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default')
+if SQLITE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join([
+                'PRAGMA journal_mode=WAL',
+                'PRAGMA synchronous=NORMAL',
+                f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 20000))}",
+                'PRAGMA mmap_size=134217728',
+                'PRAGMA cache_size=-20000',
+                'PRAGMA temp_store=MEMORY',
+            ]),
+        },
+    })
+elif SQLITE_PROFILE != 'default':
+    raise ImproperlyConfigured(f'Unknown SQLITE_PROFILE {SQLITE_PROFILE!r}; use default or production.')
+
+# Read replicas (see myapp/routers.py): SQLITE_REPLICA_PATHS is a comma
+# separated list of SQLite files opened read-only as replica1, replica2, ...
+# Locally `manage.py sync_replicas` copies the primary into them. Clients
+# and users read from the primary for REPLICA_LAG_TOLERANCE seconds after
+# they write.
+REPLICA_SQLITE_PATHS = [path for path in os.environ.get('SQLITE_REPLICA_PATHS', '').split(',') if path]
+DATABASE_REPLICAS = []
+for index, path in enumerate(REPLICA_SQLITE_PATHS, 1):
+    DATABASES[f'replica{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{path}?mode=ro',
+        'CONN_MAX_AGE': DATABASES['default'].get('CONN_MAX_AGE', 0),
+        'CONN_HEALTH_CHECKS': DATABASES['default'].get('CONN_HEALTH_CHECKS', False),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['myapp.routers.PrimaryReplicaRouter']
+REPLICA_LAG_TOLERANCE = int(os.environ.get('REPLICA_LAG_TOLERANCE', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cse-newsletter',
     }
 }
 
+# Seconds a cached post feed page / post detail response may be served.
+# Changes invalidate entries earlier through per-department versions.
+POST_CACHE_TIMEOUT = 300
+
+# Requests slower than this are logged to 'myapp.performance' together with
+# their slowest SQL statement. Per-view histograms are served at /metrics.
+PERF_SLOW_REQUEST_MS = int(os.environ.get('PERF_SLOW_REQUEST_MS', 500))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -6,4 +6,7 @@ class MyappConfig(AppConfig):
 
     def ready(self):
         import myapp.signals
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_recorder
+        connection_created.connect(install_query_recorder)
 
@@ -0,0 +1,165 @@
+"""
+Async versions of the read-heavy endpoints, for deployments served over
+ASGI. They share serializers, cache keys and validators with the DRF views
+in views.py, so a client gets byte-identical JSON from either route.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from .models import Post, User, Notification
+from .serializers import (
+    PostSerializer, UserSerializer, NotificationSerializer, PostNotificationSerializer,
+    authors_map, include_authors, requested_fields,
+)
+from .notifications import pull_mode, pull_notifications, notification_validators
+from .pagination import KeysetPagination
+from .cache import ALL_DEPARTMENTS, amerge_user_flags, cache_timeout, feed_cache_key, post_feed_validators
+from .conditional import make_etag, not_modified, set_validators
+from .routers import primary, replica_reads
+from .scores import feed_ordering
+from .subscriptions import subscribed_departments
+from .timeline import followed_queryset
+
+
+def render(data, status=200, headers=None):
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json',
+                            headers=headers)
+    response['Vary'] = 'Accept'
+    return response
+
+
+def handle_exception(request, exc):
+    # Mirrors APIView.handle_exception: 401 with a challenge when the
+    # authenticator offers one, 403 otherwise.
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+        if header:
+            exc.auth_header = header
+        else:
+            exc.status_code = 403
+    response = exception_handler(exc, {'request': request})
+    if response is None:
+        raise exc
+    headers = {name: value for name, value in response.items() if name.lower() != 'content-type'}
+    return render(response.data, response.status_code, headers)
+
+
+def async_api_view(login_required=False):
+    """
+    Read-only async counterpart of DRF's @api_view. Authentication runs the
+    configured DRF authenticators in a worker thread; the view receives a DRF
+    Request and returns either data to render as JSON or a response.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+            try:
+                if request.method not in ('GET', 'HEAD'):
+                    raise exceptions.MethodNotAllowed(request.method)
+                user = await sync_to_async(lambda: request.user)()
+                if login_required and not user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                response = await view(request, *args, **kwargs)
+            except Exception as exc:
+                return handle_exception(request, exc)
+            if not isinstance(response, HttpResponse):
+                response = render(response)
+            return response
+        return wrapper
+    return decorator
+
+
+def serialize_posts(posts, request):
+    context = {'request': request, 'include_authors': include_authors(request)}
+    return PostSerializer(posts, many=True, context=context, fields=requested_fields(request)).data
+
+
+@replica_reads
+@async_api_view()
+async def user_detail(request, username):
+    user = await aget_object_or_404(User, username=username)
+    return UserSerializer(user, context={'request': request}, fields=requested_fields(request)).data
+
+
+@replica_reads
+@async_api_view()
+async def post_list(request):
+    ordering = feed_ordering(request)
+    department = request.query_params.get('department')
+    etag, last_modified = post_feed_validators(request, [department or ALL_DEPARTMENTS])
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag, last_modified)
+
+    key = feed_cache_key(request, department)
+    page = await cache.aget(key)
+    if page is None:
+        queryset = Post.objects.all()
+        if department:
+            queryset = queryset.filter(department=department)
+        paginator = KeysetPagination()
+        paginator.ordering = ordering
+        # On the primary, like PostList's cached pages.
+        with primary():
+            posts = await paginator.apaginate_queryset(PostSerializer.setup_eager_loading(queryset), request)
+            page = {'next': paginator.get_next_link(), 'results': list(serialize_posts(posts, request))}
+            if include_authors(request):
+                page['authors'] = authors_map(posts, request)
+        await cache.aset(key, page, cache_timeout())
+    return set_validators(render(
+        dict(page, results=await amerge_user_flags(page['results'], request.user))
+    ), etag, last_modified)
+
+
+@async_api_view(login_required=True)
+async def followed_posts(request):
+    ordering = feed_ordering(request)
+    departments = sorted(subscribed_departments(request.user.subscription_mask))
+    etag, last_modified = post_feed_validators(request, departments)
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag, last_modified)
+
+    queryset, ordering = followed_queryset(request.user, departments, ordering)
+    queryset = PostSerializer.setup_eager_loading(queryset, request)
+    paginator = KeysetPagination()
+    paginator.ordering = ordering
+    posts = await paginator.apaginate_queryset(queryset, request)
+    page = {'next': paginator.get_next_link(), 'results': serialize_posts(posts, request)}
+    if include_authors(request):
+        page['authors'] = authors_map(posts, request)
+    return set_validators(render(page), etag, last_modified)
+
+
+@async_api_view(login_required=True)
+async def notification_list(request):
+    parts, last_modified = await sync_to_async(notification_validators)(request.user)
+    etag = make_etag(*parts, request.query_params.get('cursor'), request.query_params.get('page_size'))
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag, last_modified)
+
+    if pull_mode():
+        notifications = await sync_to_async(pull_notifications)(request.user)
+        serializer_class = PostNotificationSerializer
+    else:
+        notifications = Notification.objects.filter(recipient=request.user).select_related('post')
+        serializer_class = NotificationSerializer
+
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(notifications, request)
+    serializer = serializer_class(page, many=True)
+    return set_validators(render({
+        'next': paginator.get_next_link(),
+        'results': serializer.data,
+    }), etag, last_modified)
@@ -0,0 +1,54 @@
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import auth_user_cache_key, auth_user_cache_timeout
+from . import routers
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps the user in the cache for
+    AUTH_USER_CACHE_TIMEOUT seconds. The key includes the user's version
+    scope, so saving the user or changing what they follow invalidates it
+    (see bump_user_version).
+
+    With a per-process cache the bump only reaches the worker that made the
+    change, so other workers may keep a deactivated or demoted user for up to
+    the timeout. Views marked ``privileged`` therefore always load the user
+    from the database.
+    """
+    use_cache = True
+
+    def authenticate(self, request):
+        view = request.parser_context.get('view')
+        self.use_cache = not getattr(view, 'privileged', False)
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        key = auth_user_cache_key(user_id)
+        user = cache.get(key) if self.use_cache else None
+        if user is None:
+            # A replica may not have the write that bumped the version yet.
+            with routers.primary():
+                user = super().get_user(validated_token)
+            cache.set(key, user, auth_user_cache_timeout())
+            routers.authenticated(user.pk)
+            return user
+
+        # The same checks JWTAuthentication makes against a fresh row.
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        routers.authenticated(user.pk)
+        return user
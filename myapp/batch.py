@@ -0,0 +1,131 @@
+from django.db import transaction
+
+from .cache import ALL_DEPARTMENTS, bump_author_versions, bump_user_version, bump_versions, post_scope
+from .models import Post, LikedPost, SavedPost, DepartmentSubscription
+from .scores import post_count, recomputed_scores
+from .subscriptions import sync_subscription_masks
+from . import timeline
+
+BATCH_MAX_ITEMS = 100
+
+# action -> (link model, whether the link should exist afterwards)
+POST_ACTIONS = {
+    'like': (LikedPost, True),
+    'unlike': (LikedPost, False),
+    'save': (SavedPost, True),
+    'unsave': (SavedPost, False),
+}
+
+FOLLOW_ACTIONS = {'follow': True, 'unfollow': False}
+
+
+def _replay(items, key, state, desired):
+    """
+    Apply ``items`` in order to the in-memory ``state`` set and return the
+    per-item outcome: 'applied', or 'unchanged' when the item was a no-op.
+    """
+    results = []
+    for item in items:
+        item_key, wanted = key(item), desired(item)
+        if (item_key in state) == wanted:
+            results.append('unchanged')
+            continue
+        if wanted:
+            state.add(item_key)
+        else:
+            state.discard(item_key)
+        results.append('applied')
+    return results
+
+
+def apply_post_actions(user, items):
+    """
+    Apply a list of {'post_id', 'action'} items for ``user`` in one
+    transaction. Later items win over earlier ones for the same post; only
+    the net change is written, with one INSERT and one DELETE per link table
+    and two UPDATEs for the counters and scores.
+    """
+    post_ids = {item['post_id'] for item in items}
+    with transaction.atomic():
+        departments = dict(Post.objects.filter(pk__in=post_ids).values_list('id', 'department'))
+        current = {
+            (LikedPost, post_id) for post_id in
+            LikedPost.objects.filter(user=user, post_id__in=departments).values_list('post_id', flat=True)
+        } | {
+            (SavedPost, post_id) for post_id in
+            SavedPost.objects.filter(user=user, post_id__in=departments).values_list('post_id', flat=True)
+        }
+
+        found = [item for item in items if item['post_id'] in departments]
+        state = set(current)
+        outcomes = iter(_replay(
+            found,
+            key=lambda item: (POST_ACTIONS[item['action']][0], item['post_id']),
+            state=state,
+            desired=lambda item: POST_ACTIONS[item['action']][1],
+        ))
+        results = [
+            dict(item, result=next(outcomes) if item['post_id'] in departments else 'not_found')
+            for item in items
+        ]
+
+        added, removed = state - current, current - state
+        for model in (LikedPost, SavedPost):
+            model.objects.bulk_create(
+                [model(user=user, post_id=post_id) for link, post_id in added if link is model],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(
+                user=user, post_id__in=[post_id for link, post_id in removed if link is model]
+            ).delete()
+
+        changed = [post_id for link, post_id in added | removed if link is LikedPost]
+        if changed:
+            # Counted from the table rather than from our diff: a like that
+            # another request added or removed first (skipped by
+            # ignore_conflicts, or already deleted) must not count twice.
+            Post.objects.filter(pk__in=changed).update(number_of_likes=post_count(LikedPost))
+            Post.objects.filter(pk__in=changed).update(**recomputed_scores())
+            bump_versions(
+                {ALL_DEPARTMENTS}
+                | {departments[post_id] for post_id in changed if departments[post_id]}
+                | {post_scope(post_id) for post_id in changed}
+            )
+        if added or removed:
+            bump_user_version(user.pk)
+    return results
+
+
+def apply_follow_actions(user, items):
+    """Follow / unfollow departments for ``user`` in one transaction, like apply_post_actions."""
+    with transaction.atomic():
+        current = set(DepartmentSubscription.objects.filter(user=user).values_list('department', flat=True))
+        state = set(current)
+        outcomes = _replay(
+            items,
+            key=lambda item: item['department'],
+            state=state,
+            desired=lambda item: FOLLOW_ACTIONS[item['action']],
+        )
+        results = [dict(item, result=outcome) for item, outcome in zip(items, outcomes)]
+
+        added, removed = state - current, current - state
+        DepartmentSubscription.objects.bulk_create(
+            [DepartmentSubscription(user=user, department=department) for department in added],
+            ignore_conflicts=True,
+        )
+        DepartmentSubscription.objects.filter(user=user, department__in=removed).delete()
+
+        # The delete trims timelines through post_delete; bulk_create sends
+        # no post_save, so back-fill here and recompute the mask.
+        if timeline.timeline_enabled():
+            for department in added:
+                timeline.add_department(user.pk, department)
+        if added or removed:
+            # From the table, for the same reason as the like counters. The
+            # bumps cover bulk_create, which sends no post_save.
+            sync_subscription_masks([user.pk])
+            user.refresh_from_db(fields=['subscription_mask'])
+            bump_user_version(user.pk)
+            bump_author_versions(user.pk)
+    return results
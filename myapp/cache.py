@@ -0,0 +1,191 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .conditional import make_etag
+from .models import User, Post, LikedPost, SavedPost
+
+ALL_DEPARTMENTS = 'all'
+
+
+def _version_key(scope):
+    return f'posts:version:{scope}'
+
+
+# Versions are the time (in ns) of the last change to a scope. They only
+# ever move forward, so an evicted counter never repeats an old value, and
+# they double as Last-Modified for conditional requests.
+def get_version(scope):
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(scopes):
+    return {scope: get_version(scope) for scope in scopes}
+
+
+def version_datetime(version):
+    return datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+
+
+def _bump(scopes):
+    now = time.time_ns()
+    cache.set_many({_version_key(scope): now for scope in scopes}, None)
+
+
+def bump_versions(scopes):
+    """
+    Bump version scopes immediately and again after commit, so a response
+    built from pre-commit data can't outlive the transaction.
+    """
+    scopes = set(scopes)
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def bump_post_versions(post_id=None, department=None):
+    """
+    Invalidate cached feeds and post detail after a change to a post.
+    ``department=None`` means "unknown" and invalidates every department.
+    """
+    scopes = {ALL_DEPARTMENTS}
+    if department is None:
+        scopes.update(User.Department.values)
+    elif department:
+        scopes.add(department)
+    if post_id is not None:
+        scopes.add(post_scope(post_id))
+    bump_versions(scopes)
+
+
+def bump_author_versions(user_id):
+    """
+    Invalidate cached feeds and post detail that embed ``user_id`` as the
+    author, after a change to what UserSerializer shows of them.
+    """
+    posts = list(Post.objects.filter(author_id=user_id).values_list('pk', 'department'))
+    if posts:
+        bump_versions(
+            {ALL_DEPARTMENTS}
+            | {department for _, department in posts if department}
+            | {post_scope(pk) for pk, _ in posts}
+        )
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def bump_user_version(user_id):
+    # Per-user state on shared pages: likes, saves and followed departments,
+    # and the user row cached by CachedJWTAuthentication.
+    bump_versions([user_scope(user_id)])
+
+
+def auth_user_cache_key(user_id):
+    return f'auth:user:{user_id}:{get_version(user_scope(user_id))}'
+
+
+def auth_user_cache_timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60)
+
+
+def feed_cache_key(request, department):
+    params = request.query_params
+    raw = '|'.join([
+        request.get_host(), params.get('cursor', ''), params.get('page_size', ''), params.get('ordering', ''),
+        params.get('fields', ''), params.get('include', ''),
+    ])
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    scope = department or ALL_DEPARTMENTS
+    return f'posts:feed:{scope}:{get_version(scope)}:{digest}'
+
+
+def detail_cache_key(request, pk):
+    raw = '|'.join([request.get_host(), request.query_params.get('fields', '')])
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'posts:detail:{pk}:{get_version(post_scope(pk))}:{digest}'
+
+
+def cache_timeout():
+    return getattr(settings, 'POST_CACHE_TIMEOUT', 300)
+
+
+def merge_user_flags(items, user):
+    """
+    Fill in is_liked / is_saved on shared, cached post representations.
+    Returns copies; the cached objects are left untouched. Flags left out by
+    ?fields= stay out and cost no query.
+    """
+    flags = _flag_names(items)
+    items = [dict(item, **dict.fromkeys(flags, False)) for item in items]
+    if not user.is_authenticated or not flags:
+        return items
+    return _apply_flags(items, {
+        flag: set(post_ids) for flag, post_ids in _flag_querysets(items, user, flags).items()
+    })
+
+
+async def amerge_user_flags(items, user):
+    flags = _flag_names(items)
+    items = [dict(item, **dict.fromkeys(flags, False)) for item in items]
+    if not user.is_authenticated or not flags:
+        return items
+    return _apply_flags(items, {
+        flag: {post_id async for post_id in post_ids}
+        for flag, post_ids in _flag_querysets(items, user, flags).items()
+    })
+
+
+FLAG_MODELS = {'is_liked': LikedPost, 'is_saved': SavedPost}
+
+
+def _flag_names(items):
+    return [flag for flag in FLAG_MODELS if items and flag in items[0]]
+
+
+def _flag_querysets(items, user, flags):
+    ids = [item['id'] for item in items]
+    return {
+        flag: FLAG_MODELS[flag].objects.filter(user=user, post_id__in=ids).values_list('post_id', flat=True)
+        for flag in flags
+    }
+
+
+def _apply_flags(items, post_ids_by_flag):
+    for item in items:
+        for flag, post_ids in post_ids_by_flag.items():
+            item[flag] = item['id'] in post_ids
+    return items
+
+
+def post_feed_validators(request, scopes):
+    """
+    ETag and Last-Modified for a post feed over the given department scopes,
+    computed from version counters only (no database work).
+    """
+    user_id = request.user.pk if request.user.is_authenticated else None
+    versions = get_versions(list(scopes) + ([user_scope(user_id)] if user_id else []))
+    params = request.query_params
+    etag = make_etag(
+        user_id,
+        sorted(versions.items()),
+        params.get('cursor'),
+        params.get('page_size'),
+        params.get('ordering'),
+        params.get('fields'),
+        params.get('include'),
+    )
+    return etag, version_datetime(max(versions.values()))
@@ -0,0 +1,27 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def not_modified(request, etag):
+    """
+    Return a 304 response when the client's If-None-Match still matches,
+    otherwise None. If-Modified-Since is not honoured: Last-Modified has
+    whole-second resolution, so a change in the same second as the client's
+    copy would still look unmodified. Our ETags are built from the exact
+    versions instead.
+    """
+    return get_conditional_response(request, etag=etag)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -0,0 +1,90 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Post, Comment, LikedPost, SavedPost
+from .scores import post_count
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+
+# kind -> (queryset factory, columns, department lookup, date lookup).
+# Likes and saves have no timestamp of their own, so the date range
+# applies to the post they belong to.
+EXPORTS = {
+    'posts': (
+        lambda: Post.objects.annotate(number_of_saves=post_count(SavedPost)),
+        ['id', 'author_id', 'author__username', 'title', 'department', 'created_at',
+         'number_of_likes', 'number_of_comments', 'number_of_saves', 'top_score', 'hot_score'],
+        'department', 'created_at',
+    ),
+    'comments': (
+        lambda: Comment.objects.all(),
+        ['id', 'post_id', 'post__department', 'author_id', 'author__username', 'content', 'created_at'],
+        'post__department', 'created_at',
+    ),
+    'likes': (
+        lambda: LikedPost.objects.all(),
+        ['id', 'post_id', 'post__department', 'user_id', 'user__username'],
+        'post__department', 'post__created_at',
+    ),
+    'saves': (
+        lambda: SavedPost.objects.all(),
+        ['id', 'post_id', 'post__department', 'user_id', 'user__username'],
+        'post__department', 'post__created_at',
+    ),
+}
+
+
+def chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_rows(kind, department=None, since=None, until=None):
+    """
+    Rows of ``kind`` as dicts, in primary key order, filtered by department
+    and by ``since`` <= created_at < ``until``. Rows are fetched
+    EXPORT_CHUNK_SIZE at a time, so memory doesn't grow with the table.
+    """
+    queryset, columns, department_lookup, date_lookup = EXPORTS[kind]
+    queryset = queryset()
+    if department:
+        queryset = queryset.filter(**{department_lookup: department})
+    if since:
+        queryset = queryset.filter(**{f'{date_lookup}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{date_lookup}__lt': until})
+    return queryset.order_by('pk').values(*columns).iterator(chunk_size=chunk_size())
+
+
+def _value(value):
+    return value if isinstance(value, (str, int, float)) or value is None else DjangoJSONEncoder().default(value)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(kind, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORTS[kind][1])
+    for row in rows:
+        yield writer.writerow([_value(value) for value in row.values()])
+
+
+def render(kind, output, rows):
+    """Encoded chunks of ``rows`` in the ``output`` format ('ndjson' or 'csv')."""
+    lines = csv_lines(kind, rows) if output == 'csv' else ndjson_lines(rows)
+    for line in lines:
+        yield line.encode()
@@ -0,0 +1,167 @@
+import logging
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from .cache import bump_author_versions, bump_post_versions, bump_user_version
+
+logger = logging.getLogger(__name__)
+
+# Originals in these formats are rewritten without their metadata.
+STRIPPABLE_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+
+def variant_widths(kind):
+    return settings.IMAGE_VARIANT_WIDTHS[kind]
+
+
+def needs_variants(instance):
+    image = instance.image
+    if not image or not image.name:
+        return False
+    if image.name.lower().endswith('.svg'):
+        return False
+    return instance.image_variants.get('source') != image.name
+
+
+def _target_widths(original_width, widths):
+    targets = {width for width in widths if width < original_width}
+    targets.add(min(original_width, max(widths)))
+    return sorted(targets)
+
+
+def _encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    elif fmt == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_variants(field, widths):
+    """
+    Resize ``field`` to each width as the original format (JPEG, or PNG when
+    the image has transparency) and as WebP. Re-encoding drops EXIF; the
+    orientation tag is applied to the pixels first.
+    """
+    with field.open('rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    base_format = 'PNG' if has_alpha else 'JPEG'
+
+    stem, _ = os.path.splitext(field.name)
+    directory, filename = os.path.split(stem)
+    variants = []
+    for width in _target_widths(image.width, widths):
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for fmt in (base_format, 'WEBP'):
+            name = f'{directory}/variants/{filename}_{width}w.{fmt.lower().replace("jpeg", "jpg")}'
+            if field.storage.exists(name):
+                field.storage.delete(name)
+            saved = field.storage.save(name, ContentFile(_encode(resized, fmt)))
+            variants.append({
+                'name': saved,
+                'format': fmt.lower(),
+                'width': width,
+                'height': height,
+            })
+    return variants
+
+
+def strip_metadata(field):
+    """
+    Rewrite the stored original without EXIF and XMP (camera, location),
+    applying the orientation tag to the pixels first. JPEGs without one keep
+    their quantization tables, so the rewrite is close to lossless. Returns
+    whether the file was rewritten.
+    """
+    with field.open('rb') as source:
+        image = Image.open(source)
+        fmt = image.format
+        if fmt not in STRIPPABLE_FORMATS or getattr(image, 'is_animated', False):
+            return False
+        if not image.getexif() and 'xmp' not in image.info:
+            return False
+        icc_profile = image.info.get('icc_profile')
+        rotated = image.getexif().get(ExifTags.Base.Orientation, 1) != 1
+        if rotated:
+            image = ImageOps.exif_transpose(image)
+        image.load()
+
+    buffer = BytesIO()
+    if fmt == 'JPEG':
+        image.save(buffer, 'JPEG', quality=95 if rotated else 'keep', icc_profile=icc_profile, comment=b'')
+    elif fmt == 'PNG':
+        image.save(buffer, 'PNG', optimize=True, icc_profile=icc_profile)
+    else:
+        image.save(buffer, 'WEBP', quality=90, icc_profile=icc_profile)
+    field.storage.delete(field.name)
+    field.storage.save(field.name, ContentFile(buffer.getvalue()))
+    return True
+
+
+def delete_variants(storage, variants, keep=()):
+    for variant in variants:
+        if variant['name'] not in keep:
+            storage.delete(variant['name'])
+
+
+def generate_image_variants(model_label, pk):
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_variants(instance):
+        return
+
+    kind = 'post' if model_label == 'myapp.Post' else 'user'
+    source = instance.image.name
+    try:
+        strip_metadata(instance.image)
+        variants = build_variants(instance.image, variant_widths(kind))
+    except (OSError, UnidentifiedImageError):
+        logger.warning('Could not build image variants for %s %s', model_label, pk, exc_info=True)
+        variants = []
+
+    # Only store them if the image hasn't been replaced in the meantime;
+    # whichever set is not stored is deleted.
+    storage = instance.image.storage
+    stored = model.objects.filter(pk=pk, image=source).update(
+        image_variants={'source': source, 'variants': variants}
+    )
+    if not stored:
+        delete_variants(storage, variants)
+        return
+    delete_variants(
+        storage, instance.image_variants.get('variants', []), keep={variant['name'] for variant in variants}
+    )
+    if kind == 'post':
+        bump_post_versions(pk, instance.department)
+    else:
+        bump_user_version(pk)
+        bump_author_versions(pk)
+
+
+def variant_urls(instance, request=None):
+    variants = []
+    for variant in (instance.image_variants or {}).get('variants', []):
+        url = instance.image.storage.url(variant['name'])
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        variants.append({
+            'url': url,
+            'format': variant['format'],
+            'width': variant['width'],
+            'height': variant['height'],
+        })
+    return variants
@@ -0,0 +1,203 @@
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.management.commands.benchmark_endpoints import percentile
+from myapp.management.commands.seed_newsletter import SEED_PASSWORD
+
+HOST = '127.0.0.1'
+
+# (label, sync path, async path, authenticated)
+ENDPOINTS = [
+    ('post list', '/posts/', '/async/posts/', False),
+    ('followed posts', '/posts/followed/', '/async/posts/followed/', True),
+    ('notifications', '/notifications/', '/async/notifications/', True),
+    ('user detail', '/users/member0/', '/async/users/member0/', False),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway SQLite database, then compare concurrent-request throughput of the '
+        'sync views under a WSGI server (gunicorn) with the async views under an ASGI server '
+        '(uvicorn or daphne). The servers must be installed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, default=32, help='Simultaneous client connections.')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and server.')
+        parser.add_argument('--workers', type=int, default=1, help='Server processes.')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Threads per gunicorn worker.')
+        parser.add_argument('--asgi-server', choices=['uvicorn', 'daphne'], default='uvicorn')
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        for module in (options['asgi_server'], 'gunicorn'):
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'{module} is not installed (pip install {module}).')
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.env = dict(
+                os.environ,
+                SQLITE_PATH=str(Path(directory) / 'benchmark.sqlite3'),
+                BACKGROUND_TASKS_ASYNC='0',
+                PERF_SLOW_REQUEST_MS='60000',
+            )
+            self.manage('migrate', '--noinput')
+            self.manage('seed_newsletter', f'--users={options["users"]}', f'--posts={options["posts"]}',
+                        f'--seed={options["seed"]}')
+
+            results = {}
+            servers = [
+                ('wsgi', self.wsgi_command(options), 1),
+                ('asgi', self.asgi_command(options), 2),
+            ]
+            for name, command, path_index in servers:
+                port = free_port()
+                with self.serve(command(port), port):
+                    token = self.token(port)
+                    for endpoint in ENDPOINTS:
+                        label, auth = endpoint[0], endpoint[3]
+                        path = endpoint[path_index]
+                        headers = {'Authorization': f'Bearer {token}'} if auth else {}
+                        self.stdout.write(f'{name} {path} ...')
+                        results[f'{label} [{name}]'] = self.load(port, path, headers, options)
+
+        self.report(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+    def manage(self, *args):
+        subprocess.run([sys.executable, 'manage.py', *args], cwd=settings.BASE_DIR, env=self.env,
+                       check=True, stdout=subprocess.DEVNULL)
+
+    def wsgi_command(self, options):
+        return lambda port: [
+            sys.executable, '-m', 'gunicorn', 'CSENewsletter.wsgi:application',
+            '--bind', f'{HOST}:{port}', '--workers', str(options['workers']),
+            '--worker-class', 'gthread', '--threads', str(options['wsgi_threads']), '--log-level', 'warning',
+        ]
+
+    def asgi_command(self, options):
+        if options['asgi_server'] == 'daphne':
+            return lambda port: [
+                sys.executable, '-m', 'daphne', '-b', HOST, '-p', str(port), 'CSENewsletter.asgi:application',
+            ]
+        return lambda port: [
+            sys.executable, '-m', 'uvicorn', 'CSENewsletter.asgi:application', '--host', HOST,
+            '--port', str(port), '--workers', str(options['workers']), '--no-access-log', '--log-level', 'warning',
+        ]
+
+    @contextmanager
+    def serve(self, command, port):
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=self.env)
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None:
+                    raise CommandError(f'{command[2]} exited with {process.returncode}')
+                try:
+                    socket.create_connection((HOST, port), timeout=0.2).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise CommandError(f'{command[2]} did not start listening on port {port}')
+                    time.sleep(0.1)
+            yield
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def token(self, port, email='member0@seed.example.com'):
+        connection = http.client.HTTPConnection(HOST, port, timeout=30)
+        body = json.dumps({'email': email, 'password': SEED_PASSWORD})
+        connection.request('POST', '/api/token/', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise CommandError(f'Could not obtain a token: {response.status}')
+        return json.loads(response.read())['access']
+
+    def load(self, port, path, headers, options):
+        headers = dict(headers, Accept='application/json')
+        tickets = itertools.count()
+        total = options['requests']
+        lock = threading.Lock()
+        latencies, errors = [], []
+
+        def client():
+            connection = http.client.HTTPConnection(HOST, port, timeout=60)
+            while next(tickets) < total:
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection(HOST, port, timeout=60)
+                    status = None
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if status != 200:
+                        errors.append(status)
+            connection.close()
+
+        # Warm caches and connections before timing.
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            for _ in range(options['concurrency']):
+                pool.submit(self.warm, port, path, headers)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            for _ in range(options['concurrency']):
+                pool.submit(client)
+        duration = time.perf_counter() - start
+
+        return {
+            'requests_per_second': round(len(latencies) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'errors': len(errors),
+        }
+
+    def warm(self, port, path, headers):
+        connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        connection.request('GET', path, headers=headers)
+        connection.getresponse().read()
+        connection.close()
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":30} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7}')
+        for name, row in results.items():
+            self.stdout.write(
+                f'{name:30} {row["requests_per_second"]:>9} {row["p50_ms"]:>8} {row["p95_ms"]:>8} {row["errors"]:>7}'
+            )
+        for label, *_ in ENDPOINTS:
+            wsgi, asgi = results.get(f'{label} [wsgi]'), results.get(f'{label} [asgi]')
+            if wsgi and asgi and wsgi['requests_per_second']:
+                ratio = asgi['requests_per_second'] / wsgi['requests_per_second']
+                self.stdout.write(f'{label}: ASGI/async serves {ratio:.2f}x the WSGI throughput')
@@ -0,0 +1,285 @@
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import URLResolver
+from rest_framework.test import APIClient
+
+from myapp import urls as myapp_urls
+from myapp.models import User, Post, Notification
+from myapp.management.commands.seed_newsletter import SEED_PASSWORD
+
+# Routes that can't be measured offline or repeated against the same
+# database, with the reason.
+SKIPPED_ROUTES = {
+    'dj-rest-auth/google/': 'calls Google',
+    'dj-rest-auth/password/reset/': 'sends mail',
+    'dj-rest-auth/password/reset/confirm/': 'needs a mailed reset token',
+    'dj-rest-auth/registration/': 'creates an account per call',
+    'dj-rest-auth/registration/verify-email/': 'needs a mailed key; email verification is off',
+    'dj-rest-auth/registration/resend-email/': 'sends mail',
+    'dj-rest-auth/registration/account-confirm-email/(?P<key>[-:\\w]+)/': 'needs a mailed key',
+    'dj-rest-auth/registration/account-email-verification-sent/': 'placeholder view with no template',
+}
+
+
+def routes(patterns, prefix=''):
+    """(route, pattern) for every view under ``patterns``, including those of include()d URLconfs."""
+    for pattern in patterns:
+        # dj-rest-auth's re_path() routes read like 'login/?$'.
+        route = prefix + str(pattern.pattern).lstrip('^').removesuffix('$').removesuffix('?')
+        if isinstance(pattern, URLResolver):
+            yield from routes(pattern.url_patterns, route)
+        else:
+            yield route, pattern
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database and measure latency, query count and peak memory for every '
+        'route in myapp/urls.py, comparing against a stored baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative slowdown / memory growth before failing.')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Overwrite the baseline with this run.')
+        parser.add_argument('--use-current-db', action='store_true',
+                            help='Benchmark the configured database as is instead of a seeded copy; '
+                                 'it needs an active staff member.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = None
+        if not options['use_current_db']:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(BACKGROUND_TASKS_ASYNC=False):
+                if old_name is not None:
+                    call_command('seed_newsletter', users=options['users'], posts=options['posts'],
+                                 seed=options['seed'], stdout=self.stdout)
+                cache.clear()
+                results = self.run_suite(options['iterations'], seeded=old_name is not None)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+        elif baseline_path.exists():
+            regressions = self.compare(results, json.loads(baseline_path.read_text()), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline.'))
+
+    def fixtures(self, seeded):
+        reader = User.objects.annotate(total=Count('notifications')).order_by('-total', 'pk').first()
+        if reader is None:
+            raise CommandError('No users to benchmark; run seed_newsletter first.')
+        post = Post.objects.order_by('-number_of_likes', 'pk').first()
+        notification = Notification.objects.filter(recipient=reader).order_by('pk').first()
+        tokens = APIClient().post('/api/token/', {'email': reader.email, 'password': SEED_PASSWORD}).data
+        # Admin-only routes need a staff member. The seed has none, so one is
+        # added to the throwaway database; a real one is never given an
+        # account with the public seed password.
+        staff = User.objects.filter(is_staff=True, is_active=True).order_by('pk').first()
+        if staff is None and not seeded:
+            raise CommandError('--use-current-db needs an active staff member for the admin-only routes.')
+        if staff is None:
+            staff = User.objects.create_user(
+                'benchmark-staff', email='benchmark-staff@seed.example.com', password=SEED_PASSWORD,
+                first_name='Benchmark', last_name='Staff', is_staff=True,
+            )
+        return {
+            'reader': reader,
+            'staff': staff,
+            'username': reader.username,
+            'user_id': reader.pk,
+            'pk': post.pk if post else 0,
+            'notification': notification.pk if notification else 0,
+            'refresh': tokens.get('refresh', ''),
+            'access': tokens.get('access', ''),
+        }
+
+    def scenarios(self, ctx):
+        """
+        route -> list of (method, path, data, authenticated). ``authenticated``
+        is 'jwt' for the async views, which only see a real bearer token, and
+        'staff' for the admin-only views.
+        Toggle endpoints run twice per iteration so the database ends where it
+        started.
+        """
+        post, username = ctx['pk'], ctx['username']
+        return {
+            'api/token/': [('post', '/api/token/', {'email': ctx['reader'].email, 'password': SEED_PASSWORD}, False)],
+            'api/token/refresh/': [('post', '/api/token/refresh/', {'refresh': ctx['refresh']}, False)],
+            'dj-rest-auth/login/': [
+                ('post', '/dj-rest-auth/login/', {'email': ctx['reader'].email, 'password': SEED_PASSWORD}, False),
+            ],
+            'dj-rest-auth/logout/': [('post', '/dj-rest-auth/logout/', None, True)],
+            'dj-rest-auth/user/': [('get', '/dj-rest-auth/user/', None, True)],
+            'dj-rest-auth/password/change/': [('post', '/dj-rest-auth/password/change/', {
+                'new_password1': SEED_PASSWORD, 'new_password2': SEED_PASSWORD,
+            }, True)],
+            'dj-rest-auth/token/verify/': [('post', '/dj-rest-auth/token/verify/', {'token': ctx['access']}, False)],
+            'dj-rest-auth/token/refresh/': [
+                ('post', '/dj-rest-auth/token/refresh/', {'refresh': ctx['refresh']}, False),
+            ],
+            'user/profile/': [('get', '/user/profile/', None, True)],
+            'users/<str:username>/': [('get', f'/users/{username}/', None, False)],
+            'users/<str:username>/liked/': [('get', f'/users/{username}/liked/', None, False)],
+            'users/<str:username>/saved/': [('get', f'/users/{username}/saved/', None, True)],
+            'posts/': [
+                ('get', '/posts/', None, False),
+                ('get', '/posts/', None, True),
+                ('get', '/posts/?department=Development', None, True),
+                ('get', '/posts/?ordering=hot', None, False),
+            ],
+            'posts/search/': [('get', '/posts/search/?q=workshop', None, False)],
+            'posts/batch/': [
+                ('post', '/posts/batch/', [{'post_id': post, 'action': 'like'}, {'post_id': post, 'action': 'save'}], True),
+                ('post', '/posts/batch/', [{'post_id': post, 'action': 'unlike'}, {'post_id': post, 'action': 'unsave'}], True),
+            ],
+            'posts/<int:pk>/': [('get', f'/posts/{post}/', None, True)],
+            'users/<str:username>/update-role/': [
+                ('post', f'/users/{username}/update-role/', {'role': ctx['reader'].role}, True),
+            ],
+            'posts/<int:pk>/comments/': [('get', f'/posts/{post}/comments/', None, False)],
+            'posts/<int:pk>/like/': [('post', f'/posts/{post}/like/', None, True)] * 2,
+            'posts/<int:pk>/save/': [('post', f'/posts/{post}/save/', None, True)] * 2,
+            'departments/follow/': [('post', '/departments/follow/', {'department': 'HR'}, True)] * 2,
+            'departments/follow/batch/': [
+                ('post', '/departments/follow/batch/', [{'department': 'HR', 'action': 'follow'}], True),
+                ('post', '/departments/follow/batch/', [{'department': 'HR', 'action': 'unfollow'}], True),
+            ],
+            'api/user/<int:user_id>/followed-departments/': [
+                ('get', f'/api/user/{ctx["user_id"]}/followed-departments/', None, True),
+            ],
+            'posts/followed/': [('get', '/posts/followed/', None, True)],
+            'api/social-login/': [('post', '/api/social-login/', {'email': ctx['reader'].email}, False)],
+            'notifications/': [('get', '/notifications/', None, True)],
+            'notifications/unread-count/': [('get', '/notifications/unread-count/', None, True)],
+            'notifications/mark-read/': [('post', '/notifications/mark-read/', {'up_to': 1}, True)],
+            'notifications/<int:pk>/': [('get', f'/notifications/{ctx["notification"]}/', None, True)],
+            'metrics': [('get', '/metrics', None, 'staff')],
+            'export/<str:kind>/': [
+                ('get', '/export/posts/', None, 'staff'),
+                ('get', '/export/comments/?output=csv', None, 'staff'),
+            ],
+            'async/users/<str:username>/': [('get', f'/async/users/{username}/', None, False)],
+            'async/posts/': [('get', '/async/posts/', None, False)],
+            'async/posts/followed/': [('get', '/async/posts/followed/', None, 'jwt')],
+            'async/notifications/': [('get', '/async/notifications/', None, 'jwt')],
+        }
+
+    def run_suite(self, iterations, seeded):
+        ctx = self.fixtures(seeded)
+        scenarios = self.scenarios(ctx)
+        anonymous, authenticated = APIClient(), APIClient()
+        authenticated.force_authenticate(ctx['reader'])
+        bearer = APIClient()
+        bearer.credentials(HTTP_AUTHORIZATION=f'Bearer {ctx["access"]}')
+        staff = APIClient()
+        staff.force_authenticate(ctx['staff'])
+        clients = {'jwt': bearer, 'staff': staff, True: authenticated, False: anonymous}
+
+        results = {}
+        for route, _ in routes(myapp_urls.urlpatterns):
+            if route in SKIPPED_ROUTES:
+                self.stdout.write(f'skip {route}: {SKIPPED_ROUTES[route]}')
+                continue
+            if route not in scenarios:
+                raise CommandError(f'No benchmark scenario for route {route!r}.')
+
+            for method, path, data, auth in scenarios[route]:
+                query = path.partition('?')[2]
+                name = f'{method.upper()} /{route}' + (f'?{query}' if query else '')
+                name += {'staff': ' [staff]', False: ''}.get(auth, ' [auth]')
+                results[name] = self.measure(clients[auth], method, path, data, iterations)
+        return results
+
+    def measure(self, client, method, path, data, iterations):
+        def call():
+            if method == 'get':
+                response = client.get(path)
+            else:
+                response = client.post(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            # A refused request times the permission check, not the endpoint.
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {path} returned {response.status_code}')
+            return response
+
+        call()
+        timings, queries = [], []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(ctx.captured_queries))
+
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'status': response.status_code,
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'queries': max(queries),
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":65} {"status":>6} {"p50 ms":>8} {"p95 ms":>8} {"queries":>7} {"peak KiB":>9}')
+        for name, row in results.items():
+            self.stdout.write(
+                f'{name:65} {row["status"]:>6} {row["p50_ms"]:>8} {row["p95_ms"]:>8} '
+                f'{row["queries"]:>7} {row["peak_kib"]:>9}'
+            )
+
+    def compare(self, results, baseline, tolerance):
+        # An endpoint without a baseline isn't gated at all; rerun with
+        # --save-baseline in the change that adds or alters it.
+        regressions = [f'{name}: not in the baseline' for name in results if name not in baseline]
+        regressions += [f'{name}: in the baseline but no longer measured' for name in baseline if name not in results]
+        for name, row in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            # Toggles alternate between 200 and 201; only the class matters.
+            if row['status'] // 100 != base['status'] // 100:
+                regressions.append(f'{name}: status {row["status"]} (baseline {base["status"]})')
+            if row['queries'] > base['queries']:
+                regressions.append(f'{name}: {row["queries"]} queries (baseline {base["queries"]})')
+            # 1 ms of slack keeps very fast endpoints from flapping.
+            if row['p95_ms'] > base['p95_ms'] * (1 + tolerance) + 1:
+                regressions.append(f'{name}: p95 {row["p95_ms"]} ms (baseline {base["p95_ms"]} ms)')
+            if row['peak_kib'] > base['peak_kib'] * (1 + tolerance) + 64:
+                regressions.append(f'{name}: peak {row["peak_kib"]} KiB (baseline {base["peak_kib"]} KiB)')
+        return regressions
@@ -0,0 +1,140 @@
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import CommandError
+
+from myapp.management.commands.benchmark_asgi import Command as ServerBenchmark, HOST, free_port
+from myapp.management.commands.benchmark_endpoints import percentile
+
+PROFILES = ['default', 'production']
+
+
+class Command(ServerBenchmark):
+    help = (
+        'Seed a throwaway SQLite database, then hammer the like and comment endpoints from '
+        'concurrent clients against gunicorn once per SQLITE_PROFILE, reporting write '
+        'throughput and "database is locked" failures. gunicorn must be installed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent clients, each its own user.')
+        parser.add_argument('--requests', type=int, default=800, help='Writes per profile.')
+        parser.add_argument('--workers', type=int, default=4, help='gunicorn processes.')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Threads per gunicorn worker.')
+        parser.add_argument('--profile', action='append', dest='profiles', choices=PROFILES,
+                            help='Profile to run (repeatable; default: all).')
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('gunicorn') is None:
+            raise CommandError('gunicorn is not installed (pip install gunicorn).')
+        if options['clients'] > options['users']:
+            raise CommandError('--clients cannot exceed --users.')
+
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            template = Path(directory) / 'template.sqlite3'
+            self.env = dict(
+                os.environ,
+                SQLITE_PATH=str(template),
+                SQLITE_PROFILE='default',
+                BACKGROUND_TASKS_ASYNC='0',
+                PERF_SLOW_REQUEST_MS='60000',
+            )
+            self.manage('migrate', '--noinput')
+            self.manage('seed_newsletter', f'--users={options["users"]}', f'--posts={options["posts"]}',
+                        f'--seed={options["seed"]}')
+
+            for profile in options['profiles'] or PROFILES:
+                # Each profile starts from the same rollback-journal file;
+                # WAL mode sticks to a database once set.
+                path = Path(directory) / f'{profile}.sqlite3'
+                shutil.copyfile(template, path)
+                self.env = dict(self.env, SQLITE_PATH=str(path), SQLITE_PROFILE=profile)
+                port = free_port()
+                with self.serve(self.wsgi_command(options)(port), port):
+                    tokens = [
+                        self.token(port, f'member{n}@seed.example.com') for n in range(options['clients'])
+                    ]
+                    self.stdout.write(f'{profile} ...')
+                    results[profile] = self.write_load(port, tokens, options)
+
+        self.report(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+    def write_load(self, port, tokens, options):
+        """Toggle likes and add comments (3:1) on random posts until --requests writes are done."""
+        tickets = itertools.count()
+        total = options['requests']
+        lock = threading.Lock()
+        latencies, errors, lock_errors = [], [], []
+
+        def client(index, token):
+            rng = random.Random(options['seed'] * 1000 + index)
+            headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json',
+                       'Accept': 'application/json'}
+            connection = http.client.HTTPConnection(HOST, port, timeout=60)
+            while next(tickets) < total:
+                post = rng.randint(1, options['posts'])
+                if rng.random() < 0.75:
+                    path, body = f'/posts/{post}/like/', ''
+                else:
+                    path, body = f'/posts/{post}/comments/', json.dumps({'content': 'Benchmark comment'})
+                start = time.perf_counter()
+                try:
+                    connection.request('POST', path, body, headers)
+                    response = connection.getresponse()
+                    content = response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection(HOST, port, timeout=60)
+                    status, content = None, b''
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if status is None or status >= 500:
+                        errors.append(status)
+                        if b'database is locked' in content:
+                            lock_errors.append(status)
+            connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(tokens)) as pool:
+            for index, token in enumerate(tokens):
+                pool.submit(client, index, token)
+        duration = time.perf_counter() - start
+
+        return {
+            'writes_per_second': round((len(latencies) - len(errors)) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'errors': len(errors),
+            'lock_errors': len(lock_errors),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"profile":12} {"writes/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7} {"locked":>7}')
+        for name, row in results.items():
+            self.stdout.write(
+                f'{name:12} {row["writes_per_second"]:>9} {row["p50_ms"]:>8} {row["p95_ms"]:>8} '
+                f'{row["errors"]:>7} {row["lock_errors"]:>7}'
+            )
+        default, production = results.get('default'), results.get('production')
+        if default and production and default['writes_per_second']:
+            ratio = production['writes_per_second'] / default['writes_per_second']
+            self.stdout.write(f'production profile: {ratio:.2f}x the default write throughput')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp.models import Notification
+from myapp.notifications import convert_rows_to_watermarks
+
+
+class Command(BaseCommand):
+    help = "Convert Notification rows into per-department watermarks for NOTIFICATION_MODE = 'pull'."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-rows',
+            action='store_true',
+            help='Delete the converted Notification rows afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            converted = convert_rows_to_watermarks(Notification.objects.all())
+            deleted = 0
+            if options['delete_rows']:
+                deleted, _ = Notification.objects.all().delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {converted} watermarks, deleted {deleted} notification rows.'
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+
+from myapp import export
+from myapp.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream posts (with like, comment and save counts), comments, likes or saves as NDJSON '
+        'or CSV, the same rows as /export/<kind>/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(export.EXPORTS))
+        parser.add_argument('--output-format', choices=list(export.FORMATS), default='ndjson')
+        parser.add_argument('--department', choices=User.Department.values)
+        parser.add_argument('--since', help='ISO date or datetime, inclusive.')
+        parser.add_argument('--until', help='ISO date or datetime, exclusive.')
+        parser.add_argument('--output', help='Write to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        field = serializers.DateTimeField()
+        dates = {}
+        for name in ('since', 'until'):
+            if options[name]:
+                try:
+                    dates[name] = field.to_internal_value(options[name])
+                except serializers.ValidationError as exc:
+                    raise CommandError(f'--{name}: {exc.detail[0]}')
+
+        rows = export.export_rows(options['kind'], department=options['department'], **dates)
+        chunks = export.render(options['kind'], options['output_format'], rows)
+        if options['output']:
+            with open(options['output'], 'wb') as out:
+                out.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
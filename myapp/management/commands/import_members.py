@@ -0,0 +1,160 @@
+import csv
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+
+from myapp.models import User, DepartmentSubscription
+from myapp.subscriptions import DEPARTMENT_BITS
+from myapp.timeline import rebuild as rebuild_timelines, timeline_enabled
+
+# Values per IN (...) when checking for existing users; below SQLite's
+# default variable limit.
+LOOKUP_CHUNK = 900
+
+
+class MemberSerializer(serializers.Serializer):
+    email = serializers.EmailField(max_length=254)
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    first_name = serializers.CharField(max_length=150)
+    last_name = serializers.CharField(max_length=150)
+    department = serializers.ChoiceField(choices=User.Department.choices, default=User.Department.General)
+    role = serializers.ChoiceField(choices=User.Role.choices, default=User.Role.Member)
+    # Blank means an unusable password, as with create_user(password=None).
+    password = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False)
+
+
+def read_rows(path, input_format):
+    """(line number, dict) for each member in a CSV file with a header row, or a JSONL file."""
+    with open(path, newline='', encoding='utf-8') as source:
+        if input_format == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                # Empty cells fall back to the defaults, like missing keys.
+                yield reader.line_num, {key: value for key, value in row.items() if value}
+            return
+        for number, line in enumerate(source, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as exc:
+                    raise CommandError(f'line {number}: {exc}')
+
+
+@contextmanager
+def password_hasher(workers):
+    """
+    Yields a function hashing a list of passwords. PBKDF2 is CPU-bound and
+    holds the GIL, so with several workers the hashing runs in processes.
+    """
+    if workers <= 1:
+        yield lambda passwords: [make_password(password) for password in passwords]
+        return
+    with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+        yield lambda passwords: list(pool.map(
+            make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4)),
+        ))
+
+
+class Command(BaseCommand):
+    help = (
+        'Create members from a CSV (with a header row) or JSONL file: users, password hashes, '
+        'roles and General subscriptions, in bulk. The end state matches creating each user '
+        'with create_user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--input-format', choices=['csv', 'jsonl'],
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes hashing passwords; 1 hashes in this process.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        input_format = options['input_format'] or path.suffix.lstrip('.').lower()
+        if input_format not in ('csv', 'jsonl'):
+            raise CommandError('Pass --input-format csv or jsonl.')
+        if not path.exists():
+            raise CommandError(f'{path} does not exist.')
+
+        members = self.validate(read_rows(path, input_format))
+        if not members:
+            self.stdout.write('No members to import.')
+            return
+
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            # User.save gives the first two non-superusers these roles.
+            existing = User.objects.filter(is_superuser=False).count()
+            for position, member in enumerate(members, existing):
+                if position == 0:
+                    member['role'] = User.Role.President
+                elif position == 1:
+                    member['role'] = User.Role.VicePresident
+
+            user_ids = []
+            with password_hasher(options['workers']) as hash_passwords:
+                for start in range(0, len(members), batch_size):
+                    user_ids += self.create(members[start:start + batch_size], hash_passwords)
+            if timeline_enabled():
+                rebuild_timelines(user_ids)
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {len(user_ids)} members.'))
+
+    def validate(self, rows):
+        members, errors = [], []
+        for line, row in rows:
+            serializer = MemberSerializer(data=row)
+            if serializer.is_valid():
+                members.append(dict(
+                    serializer.validated_data,
+                    email=User.objects.normalize_email(serializer.validated_data['email']),
+                    username=User.normalize_username(serializer.validated_data['username']),
+                ))
+            else:
+                errors.append(f'line {line}: {json.dumps(serializer.errors)}')
+
+        for field in ('email', 'username'):
+            values = Counter(member[field] for member in members)
+            errors += [f'{field} {value!r} appears more than once' for value, n in sorted(values.items()) if n > 1]
+            unique = sorted(values)
+            for start in range(0, len(unique), LOOKUP_CHUNK):
+                taken = User.objects.filter(**{f'{field}__in': unique[start:start + LOOKUP_CHUNK]})
+                errors += [f'{field} {value!r} is already taken'
+                           for value in sorted(taken.values_list(field, flat=True))]
+        if errors:
+            raise CommandError('Nothing imported:\n  ' + '\n  '.join(errors))
+        return members
+
+    def create(self, members, hash_passwords):
+        passwords = hash_passwords([member.get('password') or None for member in members])
+        users = User.objects.bulk_create([
+            User(
+                email=member['email'],
+                username=member['username'],
+                first_name=member['first_name'],
+                last_name=member['last_name'],
+                department=member['department'],
+                role=member['role'],
+                password=password,
+                # What create_general_subscription and the mask signal leave behind.
+                subscription_mask=DEPARTMENT_BITS[User.Department.General],
+            )
+            for member, password in zip(members, passwords)
+        ])
+        DepartmentSubscription.objects.bulk_create([
+            DepartmentSubscription(user=user, department=User.Department.General) for user in users
+        ])
+        return [user.pk for user in users]
+
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.models import User
+from myapp.timeline import rebuild, trim
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the materialized followed-departments timelines from subscriptions, '
+        'or with --trim-only drop entries beyond TIMELINE_MAX_ENTRIES per user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help='Only this user (repeatable).')
+        parser.add_argument('--trim-only', action='store_true')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('pk', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError('Unknown username.')
+
+        if options['trim_only']:
+            self.stdout.write(self.style.SUCCESS(f'Trimmed {trim(user_ids)} timeline entries.'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rebuild(user_ids)} timeline entries.'))
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q, F
+from django.utils import timezone
+
+from myapp.cache import bump_post_versions, bump_versions, post_scope
+from myapp.models import Post, LikedPost, Comment
+from myapp.scores import comment_weight, hot_score, like_weight, post_count
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post.number_of_likes, number_of_comments and the scores from the link tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted posts without fixing them.')
+
+    def handle(self, *args, **options):
+        drifted = Post.objects.annotate(
+            actual_likes=post_count(LikedPost),
+            actual_comments=post_count(Comment),
+        ).filter(
+            ~Q(number_of_likes=F('actual_likes'))
+            | ~Q(number_of_comments=F('actual_comments'))
+            | ~Q(top_score=F('actual_likes') * like_weight() + F('actual_comments') * comment_weight())
+        ).values_list('pk', flat=True)
+        drifted_ids = list(drifted.iterator(chunk_size=options['batch_size']))
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted_ids)} posts have drifted counters.')
+            return
+
+        batch_size = options['batch_size']
+        now = timezone.now()
+        for start in range(0, len(drifted_ids), batch_size):
+            ids = drifted_ids[start:start + batch_size]
+            batch = Post.objects.filter(pk__in=ids)
+            with transaction.atomic():
+                batch.update(
+                    number_of_likes=post_count(LikedPost),
+                    number_of_comments=post_count(Comment),
+                )
+                batch.update(top_score=F('number_of_likes') * like_weight() + F('number_of_comments') * comment_weight())
+                batch.filter(created_at__gte=now - settings.POST_HOT_WINDOW).update(
+                    hot_score=hot_score(F('top_score'), now)
+                )
+                bump_versions([post_scope(pk) for pk in ids])
+        if drifted_ids:
+            # Cached feed pages carry the old counters and order.
+            bump_post_versions()
+
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counters on {len(drifted_ids)} posts.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from myapp.cache import bump_post_versions
+from myapp.scores import refresh_hot_scores
+
+
+class Command(BaseCommand):
+    help = 'Re-apply time decay to Post.hot_score. Run periodically (e.g. every 15 minutes from cron).'
+
+    def handle(self, *args, **options):
+        rescored = refresh_hot_scores()
+        # Cached "hot" pages are now out of order.
+        bump_post_versions()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed hot scores on {rescored} posts.'))
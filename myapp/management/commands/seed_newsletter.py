@@ -0,0 +1,189 @@
+import random
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from myapp.models import User, Post, Comment, LikedPost, SavedPost, DepartmentSubscription, Notification
+from myapp.subscriptions import sync_subscription_masks
+from myapp.timeline import rebuild as rebuild_timelines, timeline_enabled
+
+SEED_PASSWORD = 'newsletter-seed'
+
+# Rough shape of the real club: General carries most traffic.
+DEPARTMENT_WEIGHTS = {
+    User.Department.General: 30,
+    User.Department.Dev: 20,
+    User.Department.Design: 10,
+    User.Department.UIUX: 10,
+    User.Department.Comm: 10,
+    User.Department.Multimedia: 8,
+    User.Department.HR: 6,
+    User.Department.RelevRelex: 6,
+}
+
+
+def zipf_weights(count, exponent):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a realistic, reproducible newsletter workload.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--likes-per-post', type=float, default=8.0)
+        parser.add_argument('--comments-per-post', type=float, default=2.0)
+        parser.add_argument('--days', type=int, default=180, help='Spread posts over this many days.')
+        parser.add_argument('--notification-days', type=int, default=14,
+                            help='Only posts this recent get notification rows.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            subscriptions = self.create_subscriptions(users)
+            posts = self.create_posts(users, options['posts'], options['days'])
+            self.create_engagement(users, posts, options['likes_per_post'], options['comments_per_post'])
+            self.create_notifications(posts, subscriptions, options['notification_days'])
+            call_command('reconcile_counters', stdout=StringIO())
+            if timeline_enabled():
+                rebuild_timelines()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users and {len(posts)} posts '
+            f'(password for every user: {SEED_PASSWORD}).'
+        ))
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        departments = list(DEPARTMENT_WEIGHTS)
+        offset = User.objects.count()
+        users = []
+        for n in range(count):
+            department = self.random.choices(departments, weights=DEPARTMENT_WEIGHTS.values())[0]
+            users.append(User(
+                username=f'member{offset + n}',
+                email=f'member{offset + n}@seed.example.com',
+                first_name='Member',
+                last_name=str(offset + n),
+                department=department,
+                role=User.Role.Member,
+                password=password,
+            ))
+        # One manager and one assistant per department, like the real club.
+        for department in departments:
+            staff = [user for user in users if user.department == department][:2]
+            for user, role in zip(staff, [User.Role.Manager, User.Role.Assistant]):
+                user.role = role
+        if not User.objects.filter(is_superuser=False).exists():
+            users[0].role = User.Role.President
+            users[1].role = User.Role.VicePresident
+        return User.objects.bulk_create(users, batch_size=self.batch_size)
+
+    def create_subscriptions(self, users):
+        subscriptions = {department: [] for department in DEPARTMENT_WEIGHTS}
+        rows = []
+        for user in users:
+            followed = {User.Department.General, user.department}
+            for department in DEPARTMENT_WEIGHTS:
+                if self.random.random() < 0.15:
+                    followed.add(department)
+            for department in followed:
+                rows.append(DepartmentSubscription(user=user, department=department))
+                subscriptions[department].append(user.pk)
+        DepartmentSubscription.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+        sync_subscription_masks([user.pk for user in users])
+        return subscriptions
+
+    def create_posts(self, users, count, days):
+        # A handful of authors write most posts.
+        authors = self.random.sample(users, min(len(users), max(10, len(users) // 10)))
+        weights = zipf_weights(len(authors), 1.1)
+        departments = list(DEPARTMENT_WEIGHTS)
+        posts, created_at = [], []
+        for n in range(count):
+            author = self.random.choices(authors, weights=weights)[0]
+            if author.role in (User.Role.Manager, User.Role.Assistant):
+                department = author.department
+            else:
+                department = self.random.choices(departments, weights=DEPARTMENT_WEIGHTS.values())[0]
+            words = self.random.randint(40, 400)
+            posts.append(Post(
+                author=author,
+                title=f'{department} update #{n}',
+                content=' '.join(self.random.choice(WORDS) for _ in range(words)),
+                department=department,
+            ))
+            created_at.append(self.now - timedelta(seconds=self.random.randint(0, days * 86400)))
+
+        posts = Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        # auto_now_add ignores explicit values on insert.
+        for post, timestamp in zip(posts, created_at):
+            post.created_at = timestamp
+        Post.objects.bulk_update(posts, ['created_at'], batch_size=self.batch_size)
+        return posts
+
+    def create_engagement(self, users, posts, likes_per_post, comments_per_post):
+        popularity = [self.random.paretovariate(1.5) for _ in posts]
+        scale = len(posts) / sum(popularity)
+        likes, saves, comments = [], [], []
+        for post, weight in zip(posts, popularity):
+            like_count = min(len(users), int(weight * scale * likes_per_post))
+            for user in self.random.sample(users, like_count):
+                likes.append(LikedPost(user=user, post=post))
+                if self.random.random() < 0.2:
+                    saves.append(SavedPost(user=user, post=post))
+            for _ in range(int(weight * scale * comments_per_post)):
+                comments.append(Comment(
+                    post=post,
+                    author=self.random.choice(users),
+                    content=' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(3, 40))),
+                ))
+        LikedPost.objects.bulk_create(likes, batch_size=self.batch_size)
+        SavedPost.objects.bulk_create(saves, batch_size=self.batch_size)
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+
+    def create_notifications(self, posts, subscriptions, days):
+        since = self.now - timedelta(days=days)
+        read_before = self.now - timedelta(days=2)
+        batch = []
+        for post in posts:
+            if post.created_at < since:
+                continue
+            for user_id in subscriptions.get(post.department, []):
+                if user_id == post.author_id:
+                    continue
+                batch.append(Notification(
+                    recipient_id=user_id,
+                    post=post,
+                    is_read=post.created_at < read_before and self.random.random() < 0.8,
+                ))
+            if len(batch) >= self.batch_size:
+                Notification.objects.bulk_create(batch)
+                batch = []
+        Notification.objects.bulk_create(batch)
+        # Fan-out happens when the post is published.
+        Notification.objects.filter(post__created_at__gte=since).update(
+            created_at=Subquery(Post.objects.filter(pk=OuterRef('post_id')).values('created_at'))
+        )
+
+
+WORDS = (
+    'club workshop session meetup design sprint review django react figma deadline team event '
+    'hackathon poster video interview partner sponsor budget recruitment onboarding mentor talk '
+    'slides feedback release backend frontend api database deploy bug fix feature roadmap vote'
+).split()
@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database into every SQLITE_REPLICA_PATHS file, once or every '
+        '--interval seconds. A local stand-in for replication: the replicas lag by up to the interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep copying, this many seconds apart.')
+
+    def handle(self, *args, **options):
+        paths = getattr(settings, 'REPLICA_SQLITE_PATHS', [])
+        if not paths:
+            raise CommandError('No replicas configured; set SQLITE_REPLICA_PATHS.')
+
+        while True:
+            start = time.perf_counter()
+            for path in paths:
+                self.copy(str(settings.DATABASES['default']['NAME']), path)
+            self.stdout.write(f'Copied the primary to {len(paths)} replicas in '
+                              f'{(time.perf_counter() - start) * 1000:.0f} ms.')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def copy(self, source_path, replica_path):
+        source = sqlite3.connect(source_path)
+        replica = sqlite3.connect(replica_path, timeout=30)
+        try:
+            source.backup(replica)
+            # Replicas are opened read-only, which a WAL database doesn't
+            # allow without its -shm file.
+            replica.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            replica.close()
+            source.close()
@@ -0,0 +1,218 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework import serializers
+
+logger = logging.getLogger('myapp.performance')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'serialize_time', 'slowest_sql', 'slowest_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.slowest_sql = None
+        self.slowest_time = 0.0
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver. The wrapper stays installed for the life of
+    the connection and does nothing outside a measured request, which keeps
+    it correct when ASGI requests share a connection's thread.
+    """
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.queries += 1
+        metrics.db_time += elapsed
+        if elapsed > metrics.slowest_time:
+            metrics.slowest_time = elapsed
+            metrics.slowest_sql = sql
+
+
+@contextmanager
+def timed_serialization():
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += time.perf_counter() - start
+
+
+class TimedDataMixin:
+    """Counts the top-level ``.data`` call towards the request's serializer time."""
+
+    @property
+    def data(self):
+        with timed_serialization():
+            return super().data
+
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    pass
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class ViewStats:
+    __slots__ = ('duration', 'db', 'serialize', 'queries')
+
+    def __init__(self):
+        self.duration = Histogram()
+        self.db = Histogram()
+        self.serialize = Histogram()
+        self.queries = 0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, total, metrics):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats()
+            stats.duration.observe(total)
+            stats.db.observe(metrics.db_time)
+            stats.serialize.observe(metrics.serialize_time)
+            stats.queries += metrics.queries
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = []
+            for name, attribute, help_text in (
+                ('newsletter_request_duration_seconds', 'duration', 'Total request time.'),
+                ('newsletter_request_db_seconds', 'db', 'Time spent in SQL per request.'),
+                ('newsletter_request_serialize_seconds', 'serialize', 'Time spent in serializers per request.'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for view, stats in views:
+                    histogram = getattr(stats, attribute)
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.total:.6f}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            lines.append('# HELP newsletter_request_queries_total SQL queries issued.')
+            lines.append('# TYPE newsletter_request_queries_total counter')
+            for view, stats in views:
+                lines.append(f'newsletter_request_queries_total{{view="{view}"}} {stats.queries}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.url_name or match.route or 'unnamed'
+
+
+class PerformanceMiddleware:
+    """
+    Times every request, its SQL and its serializers, adds a Server-Timing
+    header, logs requests over PERF_SLOW_REQUEST_MS with their slowest query
+    and feeds the per-view histograms served at /metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    def finish(self, request, response, metrics, total):
+        view = view_name(request)
+        registry.observe(view, total, metrics)
+        response['Server-Timing'] = (
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+            f'serialize;dur={metrics.serialize_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+        if total * 1000 > getattr(settings, 'PERF_SLOW_REQUEST_MS', 500):
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms total, %d queries in %.0f ms, serializers %.0f ms; '
+                'slowest query (%.0f ms): %s',
+                request.method, request.path, view, total * 1000, metrics.queries, metrics.db_time * 1000,
+                metrics.serialize_time * 1000, metrics.slowest_time * 1000, metrics.slowest_sql,
+            )
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.9 on 2026-10-18 11:35
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_links(apps, schema_editor):
+    # Keep the oldest row per (user, post) so the unique constraints apply.
+    for model_name in ('LikedPost', 'SavedPost'):
+        model = apps.get_model('myapp', model_name)
+        keep = model.objects.values('user', 'post').annotate(first_id=Min('id')).values('first_id')
+        model.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_alter_user_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recipient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['department', '-created_at', '-id'], name='post_department_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='likedpost',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_liked_post'),
+        ),
+        migrations.AddConstraint(
+            model_name='savedpost',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_saved_post'),
+        ),
+    ]
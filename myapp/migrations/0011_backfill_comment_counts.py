@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-18 11:52
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comment_counts(apps, schema_editor):
+    # number_of_comments was never maintained before this point.
+    Post = apps.get_model('myapp', 'Post')
+    Comment = apps.get_model('myapp', 'Comment')
+    counts = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('pk')).values('total')
+    Post.objects.update(number_of_comments=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_comment_counts, migrations.RunPython.noop),
+    ]
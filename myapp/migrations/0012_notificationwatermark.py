@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 11:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_backfill_comment_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department', models.CharField(choices=[('General', 'General'), ('HR', 'Hr'), ('Development', 'Dev'), ('UI/UX', 'Uiux'), ('Design', 'Design'), ('Relev/Relex', 'Relevrelex'), ('Communication', 'Comm'), ('Multimedia', 'Multimedia')], max_length=15)),
+                ('last_read_post_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_watermarks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'department'), name='unique_notification_watermark')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:05
+
+from django.db import migrations
+
+# External-content FTS5 index over Post.title / Post.content. Triggers keep
+# it in sync on every insert, delete and title/content update.
+#
+# SQLite adds NOT NULL columns by rebuilding the table, which drops its
+# triggers: a later migration that rebuilds myapp_post must re-create them
+# from SYNC_TRIGGERS (see 0018).
+CREATE_TABLE = """
+    CREATE VIRTUAL TABLE myapp_post_fts USING fts5(
+        title, content, content='myapp_post', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+"""
+
+SYNC_TRIGGERS = [
+    """
+    CREATE TRIGGER myapp_post_fts_insert AFTER INSERT ON myapp_post BEGIN
+        INSERT INTO myapp_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_post_fts_delete AFTER DELETE ON myapp_post BEGIN
+        INSERT INTO myapp_post_fts(myapp_post_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_post_fts_update AFTER UPDATE OF title, content ON myapp_post BEGIN
+        INSERT INTO myapp_post_fts(myapp_post_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO myapp_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+DROP_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS myapp_post_fts_update',
+    'DROP TRIGGER IF EXISTS myapp_post_fts_delete',
+    'DROP TRIGGER IF EXISTS myapp_post_fts_insert',
+]
+
+REBUILD = "INSERT INTO myapp_post_fts(myapp_post_fts) VALUES ('rebuild')"
+
+CREATE_INDEX = [CREATE_TABLE, *SYNC_TRIGGERS, REBUILD]
+
+DROP_INDEX = [*DROP_TRIGGERS, 'DROP TABLE IF EXISTS myapp_post_fts']
+
+
+def run_on_sqlite(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_notificationwatermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_INDEX), run_on_sqlite(DROP_INDEX)),
+    ]
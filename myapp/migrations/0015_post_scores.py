@@ -0,0 +1,63 @@
+# Generated by Django 5.2.9 on 2026-10-18 11:55
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import Cast, Greatest, Power
+from django.utils import timezone
+
+
+def backfill_scores(apps, schema_editor):
+    Post = apps.get_model('myapp', 'Post')
+    Post.objects.update(top_score=(
+        F('number_of_likes') * getattr(settings, 'POST_SCORE_LIKE_WEIGHT', 1)
+        + F('number_of_comments') * getattr(settings, 'POST_SCORE_COMMENT_WEIGHT', 2)
+    ))
+    # myapp.scores.hot_score as of this migration:
+    # top_score / (age_in_hours + 2) ** gravity.
+    now = timezone.now()
+    age = ExpressionWrapper(Value(now, output_field=DateTimeField()) - F('created_at'), output_field=DurationField())
+    hours = Greatest(Cast(age, FloatField()) / 3.6e9, Value(0.0))
+    gravity = getattr(settings, 'POST_SCORE_GRAVITY', 1.5)
+    Post.objects.filter(created_at__gte=now - getattr(settings, 'POST_HOT_WINDOW', timedelta(days=7))).update(
+        hot_score=Cast(F('top_score'), FloatField()) / Power(hours + 2, gravity)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='top_score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-top_score', '-id'], name='post_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['department', '-top_score', '-id'], name='post_department_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['department', '-hot_score', '-id'], name='post_department_hot_idx'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.9 on 2026-10-18 12:06
+
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+# User.Department -> bit as of this migration (myapp.subscriptions.DEPARTMENT_BITS).
+DEPARTMENT_BITS = {
+    'General': 1,
+    'HR': 2,
+    'Development': 4,
+    'UI/UX': 8,
+    'Design': 16,
+    'Relev/Relex': 32,
+    'Communication': 64,
+    'Multimedia': 128,
+}
+
+
+def backfill_masks(apps, schema_editor):
+    User = apps.get_model('myapp', 'User')
+    DepartmentSubscription = apps.get_model('myapp', 'DepartmentSubscription')
+    # Each (user, department) pair is unique, so summing the bits ORs them.
+    bits = Case(
+        *[When(department=department, then=Value(bit)) for department, bit in DEPARTMENT_BITS.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    masks = DepartmentSubscription.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(
+        mask=Sum(bits)
+    ).values('mask')
+    User.objects.update(subscription_mask=Coalesce(Subquery(masks, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='subscription_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_masks, migrations.RunPython.noop),
+    ]
@@ -25,6 +25,11 @@ class User(AbstractUser):
     department = models.CharField(max_length=15, choices=Department.choices, default=Department.General)
     role = models.CharField(max_length=15, choices=Role.choices, default=Role.Member)
     image = models.ImageField(upload_to='user_images/', blank=True, null=True, default='user_images/default-profile.svg')
+    # Filled in by images.generate_image_variants after an upload.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # One bit per followed department, kept in step with DepartmentSubscription
+    # so reads don't query it; see myapp/subscriptions.py.
+    subscription_mask = models.PositiveSmallIntegerField(default=0, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -47,7 +52,21 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     number_of_likes = models.IntegerField(default=0)
     number_of_comments = models.IntegerField(default=0)
+    # Maintained with the counters; see myapp/scores.py.
+    top_score = models.IntegerField(default=0)
+    hot_score = models.FloatField(default=0)
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            models.Index(fields=['department', '-created_at', '-id'], name='post_department_created_idx'),
+            models.Index(fields=['-top_score', '-id'], name='post_top_idx'),
+            models.Index(fields=['department', '-top_score', '-id'], name='post_department_top_idx'),
+            models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+            models.Index(fields=['department', '-hot_score', '-id'], name='post_department_hot_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.pk:
@@ -67,14 +86,29 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_idx'),
+        ]
+
 class LikedPost(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_liked_post'),
+        ]
+
 class SavedPost(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_saved_post'),
+        ]
+
 class DepartmentSubscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
     department = models.CharField(max_length=15, choices=User.Department.choices)
@@ -88,6 +122,43 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recipient_idx'),
+            models.Index(fields=['recipient'], condition=models.Q(is_read=False), name='notification_unread_idx'),
+        ]
+
+# Read state for NOTIFICATION_MODE = 'pull': every post in ``department``
+# with an id up to ``last_read_post_id`` counts as read for ``user``.
+class NotificationWatermark(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_watermarks')
+    department = models.CharField(max_length=15, choices=User.Department.choices)
+    last_read_post_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'department'], name='unique_notification_watermark'),
+        ]
+
+# Materialized FollowedDepartmentsPostsView (TIMELINE_ENABLED): one row per
+# follower per post in a followed department, so a page is a single range
+# scan over timeline_user_idx. See myapp/timeline.py.
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    department = models.CharField(max_length=15, choices=User.Department.choices)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_idx'),
+            models.Index(fields=['user', 'department'], name='timeline_user_department_idx'),
+        ]
+
 @receiver(post_save, sender=User)
 def create_general_subscription(sender, instance, created, **kwargs):
     if created:
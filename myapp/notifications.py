@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.db.models import BooleanField, Case, Count, Max, Min, Q, Sum, Value, When
+from django.utils import timezone
+
+from .cache import get_versions, version_datetime
+from .models import Post, Notification, NotificationWatermark
+from .subscriptions import subscribed_departments
+
+
+def pull_mode():
+    return getattr(settings, 'NOTIFICATION_MODE', 'push') == 'pull'
+
+
+def get_watermarks(user):
+    return dict(
+        NotificationWatermark.objects.filter(user=user).values_list('department', 'last_read_post_id')
+    )
+
+
+def pull_notifications(user):
+    """
+    Notifications for ``user`` built from recent posts in the departments
+    they follow, with ``is_read`` derived from the per-department watermarks.
+    """
+    departments = subscribed_departments(user.subscription_mask)
+    watermarks = get_watermarks(user)
+    read = [
+        When(department=department, id__lte=watermarks[department], then=Value(True))
+        for department in departments
+        if watermarks.get(department)
+    ]
+    since = timezone.now() - settings.NOTIFICATION_PULL_WINDOW
+    return Post.objects.filter(
+        department__in=departments,
+        created_at__gte=since,
+    ).exclude(author=user).annotate(
+        is_read=Case(*read, default=Value(False), output_field=BooleanField())
+    )
+
+
+def set_watermark(user, department, post_id):
+    NotificationWatermark.objects.update_or_create(
+        user=user, department=department, defaults={'last_read_post_id': post_id}
+    )
+
+
+def mark_post_read(user, post, is_read=True):
+    current = get_watermarks(user).get(post.department, 0)
+    if is_read and post.pk > current:
+        set_watermark(user, post.department, post.pk)
+    elif not is_read and post.pk <= current:
+        # Watermarks are ranges, so unreading a post also unreads newer ones.
+        set_watermark(user, post.department, post.pk - 1)
+
+
+def convert_rows_to_watermarks(notifications):
+    """
+    Turn push-mode Notification rows into watermarks. Each watermark stops
+    just before the oldest unread post, so nothing unread is lost.
+    """
+    summary = notifications.exclude(post__isnull=True).values(
+        'recipient_id', 'post__department'
+    ).annotate(
+        max_read=Max('post_id', filter=Q(is_read=True)),
+        min_unread=Min('post_id', filter=Q(is_read=False)),
+    ).order_by()
+
+    watermarks = []
+    for row in summary.iterator():
+        if not row['post__department']:
+            continue
+        if row['min_unread'] is not None:
+            last_read = row['min_unread'] - 1
+        else:
+            last_read = row['max_read']
+        watermarks.append(NotificationWatermark(
+            user_id=row['recipient_id'],
+            department=row['post__department'],
+            last_read_post_id=last_read,
+        ))
+
+    NotificationWatermark.objects.bulk_create(
+        watermarks,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['user', 'department'],
+        update_fields=['last_read_post_id'],
+    )
+    return len(watermarks)
+
+
+def notification_validators(user):
+    """
+    Cheap inputs for the notification list's ETag plus its Last-Modified,
+    without building the list itself.
+    """
+    if pull_mode():
+        departments = sorted(subscribed_departments(user.subscription_mask))
+        watermarks = sorted(get_watermarks(user).items())
+        versions = get_versions(departments)
+        last_modified = version_datetime(max(versions.values())) if versions else None
+        return [departments, watermarks, sorted(versions.items())], last_modified
+
+    summary = Notification.objects.filter(recipient=user).aggregate(
+        latest=Max('created_at'),
+        total=Count('id'),
+        unread=Count('id', filter=Q(is_read=False)),
+        unread_ids=Sum('id', filter=Q(is_read=False)),
+    )
+    # Each notification shows its post's title and department. Editing a
+    # post bumps every department, so the followed ones cover them all.
+    versions = get_versions(sorted(subscribed_departments(user.subscription_mask)))
+    modified = [version_datetime(version) for version in versions.values()]
+    if summary['latest']:
+        modified.append(summary['latest'])
+    return [
+        summary['latest'], summary['total'], summary['unread'], summary['unread_ids'], sorted(versions.items()),
+    ], max(modified, default=None)
+
+
+def unread_count(user):
+    if pull_mode():
+        return pull_notifications(user).filter(is_read=False).count()
+    # Answered from the partial notification_unread_idx index.
+    return Notification.objects.filter(recipient=user, is_read=False).count()
+
+
+def mark_all_read(user, up_to=None):
+    """
+    Mark every notification (or every one with id <= ``up_to``) as read in
+    a single write. Returns the number of rows or departments updated.
+    """
+    if not pull_mode():
+        notifications = Notification.objects.filter(recipient=user, is_read=False)
+        if up_to is not None:
+            notifications = notifications.filter(id__lte=up_to)
+        return notifications.update(is_read=True)
+
+    posts = pull_notifications(user)
+    if up_to is not None:
+        posts = posts.filter(id__lte=up_to)
+    current = get_watermarks(user)
+    watermarks = [
+        NotificationWatermark(user=user, department=row['department'], last_read_post_id=row['latest'])
+        for row in posts.order_by().values('department').annotate(latest=Max('id'))
+        if row['latest'] > current.get(row['department'], 0)
+    ]
+    NotificationWatermark.objects.bulk_create(
+        watermarks,
+        update_conflicts=True,
+        unique_fields=['user', 'department'],
+        update_fields=['last_read_post_id', 'updated_at'],
+    )
+    return len(watermarks)
@@ -0,0 +1,145 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque cursor pagination over a unique, descending sort key.
+
+    The cursor holds the sort values of the last row on the page, so page N
+    is a single index range scan and no COUNT(*) is ever issued. Views can
+    override the key with a ``cursor_ordering`` attribute.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 20
+        if self.page_size_query_param in request.query_params:
+            try:
+                requested = int(request.query_params[self.page_size_query_param])
+            except (TypeError, ValueError):
+                return page_size
+            if requested > 0:
+                page_size = min(requested, self.max_page_size)
+        return page_size
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.page_queryset(queryset, request, view))
+        return self.set_page(rows)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        rows = [row async for row in self.page_queryset(queryset, request, view)]
+        return self.set_page(rows)
+
+    def page_queryset(self, queryset, request, view=None):
+        """The page plus one extra row, which tells whether there is a next page."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keys = [field.lstrip('-') for field in self.get_ordering(view)]
+
+        queryset = queryset.order_by(*self.get_ordering(view))
+        position = self.decode_cursor(request, [self.key_field(queryset, key) for key in self.keys])
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position))
+        return queryset[:self.page_size + 1]
+
+    def key_field(self, queryset, key):
+        if key in queryset.query.annotations:
+            return queryset.query.annotations[key].output_field
+        return queryset.model._meta.get_field(key)
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def keyset_filter(self, position):
+        # (k1 < v1) OR (k1 = v1 AND (k2 < v2 OR ...)), plus a redundant
+        # k1 <= v1 so the database can seek into the index instead of
+        # filtering from the top.
+        pairs = list(zip(self.keys, position))
+        name, value = pairs[-1]
+        condition = Q(**{f'{name}__lt': value})
+        for name, value in reversed(pairs[:-1]):
+            condition = Q(**{f'{name}__lt': value}) | (Q(**{name: value}) & condition)
+        first_name, first_value = pairs[0]
+        return Q(**{f'{first_name}__lte': first_value}) & condition
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = [self._position_value(getattr(last, key)) for key in self.keys]
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def encode_cursor(self, position):
+        payload = json.dumps(position, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    def decode_cursor(self, request, fields):
+        """The cursor's sort values, parsed for ``fields`` (the sort keys' model fields)."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            if not isinstance(position, list) or len(position) != len(fields):
+                raise ValueError(position)
+            return [self._parse_position_value(field, value) for field, value in zip(fields, position)]
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _parse_position_value(self, field, value):
+        # The inverse of _position_value; anything else was not made by us.
+        if isinstance(field, models.DateTimeField):
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError(value)
+            return parsed
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(value)
+        if isinstance(field, models.FloatField):
+            return float(value)
+        if not isinstance(value, int):
+            raise TypeError(value)
+        return value
+
+    def _position_value(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
@@ -0,0 +1,146 @@
+"""
+Primary/replica routing. Reads from views marked with ``replica_reads`` go
+to one of DATABASE_REPLICAS on GET and HEAD; everything else, and every
+read after the request has written, goes to ``default``. A write also pins
+the client (by cookie) and the user (by cache) to the primary for
+REPLICA_LAG_TOLERANCE seconds, so they read their own writes while the
+replicas catch up. Responses cached or validated under the post versions
+are built on the primary regardless: a write bumps those versions before
+the replicas have it, and a stale page would then outlive the lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'db_primary'
+
+_state = ContextVar('db_routing', default=None)
+_forced_primary = ContextVar('db_forced_primary', default=False)
+
+
+class RoutingState:
+    def __init__(self):
+        self.replica_allowed = False
+        self.pinned = False
+        self.wrote = False
+        self.user_id = None
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def lag_tolerance():
+    return getattr(settings, 'REPLICA_LAG_TOLERANCE', 5)
+
+
+def _pin_key(user_id):
+    return f'db:primary:{user_id}'
+
+
+def replica_reads(view):
+    """Mark a function view as safe to serve from a replica."""
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block, e.g. for auth lookups."""
+    token = _forced_primary.set(True)
+    try:
+        yield
+    finally:
+        _forced_primary.reset(token)
+
+
+def authenticated(user_id):
+    """Called once the request's user is known; honours a pin from an earlier write."""
+    state = _state.get()
+    if state is None:
+        return
+    state.user_id = user_id
+    if state.replica_allowed and cache.get(_pin_key(user_id)):
+        state.pinned = True
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None or not state.replica_allowed or state.pinned
+            or _forced_primary.get() or not replicas()
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema with the data (see sync_replicas).
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(response, state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        view = getattr(view_func, 'cls', view_func)
+        state.replica_allowed = (
+            request.method in ('GET', 'HEAD')
+            and getattr(view, 'replica_reads', False)
+            and PIN_COOKIE not in request.COOKIES
+        )
+
+    def finish(self, response, state):
+        if state.wrote:
+            lag = lag_tolerance()
+            response.set_cookie(PIN_COOKIE, '1', max_age=lag, httponly=True, samesite='Lax')
+            if state.user_id is not None:
+                cache.set(_pin_key(state.user_id), True, lag)
+        return response
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db.models import (
+    Count, DateTimeField, DurationField, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Subquery, Value,
+)
+from django.db.models.functions import Cast, Coalesce, Greatest, Power
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Post
+
+# ?ordering= value -> keyset sort key. Scores move, so a client paging
+# through "hot" or "top" may see a post twice or miss one that jumps.
+FEED_ORDERINGS = {
+    'new': ('-created_at', '-id'),
+    'top': ('-top_score', '-id'),
+    'hot': ('-hot_score', '-id'),
+}
+
+
+def feed_ordering(request):
+    name = request.query_params.get('ordering') or 'new'
+    if name not in FEED_ORDERINGS:
+        raise ValidationError({'ordering': [f'Must be one of: {", ".join(FEED_ORDERINGS)}.']})
+    return FEED_ORDERINGS[name]
+
+
+def like_weight():
+    return getattr(settings, 'POST_SCORE_LIKE_WEIGHT', 1)
+
+
+def comment_weight():
+    return getattr(settings, 'POST_SCORE_COMMENT_WEIGHT', 2)
+
+
+def hot_score(top_score, now):
+    """
+    SQL expression for ``top_score / (age_in_hours + 2) ** gravity``, evaluated
+    against ``now`` so a single UPDATE can apply it to many rows.
+    """
+    age = ExpressionWrapper(Value(now, output_field=DateTimeField()) - F('created_at'), output_field=DurationField())
+    # Durations are microseconds on SQLite.
+    hours = Greatest(Cast(age, FloatField()) / 3.6e9, Value(0.0))
+    return Cast(top_score, FloatField()) / Power(hours + 2, getattr(settings, 'POST_SCORE_GRAVITY', 1.5))
+
+
+def score_changes(likes=0, comments=0):
+    """
+    update() kwargs that move a post's scores by ``likes`` / ``comments``.
+    The SET clause reads the old top_score, so concurrent updates don't lose
+    increments.
+    """
+    top_score = F('top_score') + (likes * like_weight() + comments * comment_weight())
+    return {'top_score': top_score, 'hot_score': hot_score(top_score, timezone.now())}
+
+
+def recomputed_scores():
+    """
+    update() kwargs that set a post's scores from its counter columns, as
+    they are before the UPDATE.
+    """
+    top_score = F('number_of_likes') * like_weight() + F('number_of_comments') * comment_weight()
+    return {'top_score': top_score, 'hot_score': hot_score(top_score, timezone.now())}
+
+
+def post_count(model):
+    """
+    SQL expression counting the ``model`` rows (likes, saves, comments) that
+    point at each post, for annotating or updating Post querysets.
+    """
+    counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+        total=Count('pk')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def refresh_hot_scores(now=None):
+    """
+    Re-apply time decay to every post in POST_HOT_WINDOW and zero the ones
+    that have aged out. Returns the number of posts rescored.
+    """
+    now = now or timezone.now()
+    since = now - settings.POST_HOT_WINDOW
+    Post.objects.filter(created_at__lt=since).exclude(hot_score=0).update(hot_score=0)
+    return Post.objects.filter(created_at__gte=since).update(hot_score=hot_score(F('top_score'), now))
@@ -0,0 +1,94 @@
+import html
+import re
+from collections import namedtuple
+
+from django.db import connection, connections, models, router
+
+from .models import Post
+from .pagination import KeysetPagination
+
+SearchHit = namedtuple('SearchHit', ['id', 'rank', 'title_highlight', 'snippet'])
+
+# Title matches weigh more than body matches in the bm25 ranking.
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+SNIPPET_TOKENS = 16
+
+# Private-use markers survive FTS5 untouched and are swapped for <mark>
+# only after the surrounding text has been HTML-escaped.
+_OPEN, _CLOSE = '\ue000', '\ue001'
+
+
+def match_expression(text):
+    """
+    Turn free text into a safe FTS5 query: every word must match, and the
+    last one also matches as a prefix so search-as-you-type works.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(text):
+    return html.escape(text).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search_posts(text, department=None, position=None, limit=20):
+    """
+    Ranked post ids for ``text``, best match first, starting after the
+    (rank, id) ``position`` of the previous page.
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return []
+
+    rank = f'bm25(myapp_post_fts, {TITLE_WEIGHT}, {CONTENT_WEIGHT})'
+    sql = [
+        f'SELECT p.id, {rank},',
+        'highlight(myapp_post_fts, 0, %s, %s),',
+        f'snippet(myapp_post_fts, 1, %s, %s, %s, {SNIPPET_TOKENS})',
+        'FROM myapp_post_fts JOIN myapp_post p ON p.id = myapp_post_fts.rowid',
+        'WHERE myapp_post_fts MATCH %s',
+    ]
+    params = [_OPEN, _CLOSE, _OPEN, _CLOSE, '…', expression]
+    if department:
+        sql.append('AND p.department = %s')
+        params.append(department)
+    if position is not None:
+        sql.append(f'AND ({rank} > %s OR ({rank} = %s AND p.id < %s))')
+        params.extend([position[0], position[0], position[1]])
+    sql.append(f'ORDER BY {rank}, p.id DESC LIMIT %s')
+    params.append(limit)
+
+    # On a replica when the view allows it, like the ORM reads around it.
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(' '.join(sql), params)
+        return [
+            SearchHit(post_id, score, highlight(title), highlight(snippet))
+            for post_id, score, title, snippet in cursor.fetchall()
+        ]
+
+
+class SearchPagination(KeysetPagination):
+    ordering = ('rank', '-id')
+    key_fields = (models.FloatField(), models.IntegerField())
+
+    def paginate_search(self, text, department, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keys = [field.lstrip('-') for field in self.ordering]
+
+        hits = search_posts(text, department, self.decode_cursor(request, self.key_fields), self.page_size + 1)
+        self.has_next = len(hits) > self.page_size
+        self.page = hits[:self.page_size]
+        return self.page
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO myapp_post_fts(myapp_post_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO myapp_post_fts(myapp_post_fts) VALUES ('optimize')")
@@ -1,6 +1,11 @@
+from django.db.models import Exists, OuterRef, Value
 from rest_framework import serializers
 from dj_rest_auth.registration.serializers import RegisterSerializer
 from .models import Post, Comment, LikedPost, SavedPost, User, Notification
+from .notifications import mark_post_read
+from .images import variant_urls
+from .metrics import TimedDataMixin, TimedListSerializer
+from .subscriptions import subscribed_departments
 
 class CustomRegisterSerializer(RegisterSerializer):
     first_name = serializers.CharField(required=True)
@@ -11,35 +16,103 @@ class CustomRegisterSerializer(RegisterSerializer):
         user.last_name = self.validated_data.get('last_name', '')
         user.save(update_fields=['first_name', 'last_name'])
 
-class UserSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """Field names asked for with ?fields=a,b on a GET, or None for all of them."""
+    if request is None or request.method != 'GET' or not request.query_params.get('fields'):
+        return None
+    return [name.strip() for name in request.query_params['fields'].split(',') if name.strip()]
+
+
+def include_authors(request):
+    """?include=authors: posts and comments carry author_id and the page sideloads the authors."""
+    if request is None or request.method != 'GET':
+        return False
+    return 'authors' in request.query_params.get('include', '').split(',')
+
+
+class SparseFieldsMixin:
+    """
+    ``fields=[...]`` limits the output to those fields (``id`` is always
+    kept). With ``include_authors`` in the context the nested author is
+    replaced by ``author_id``; see authors_map().
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if self.context.get('include_authors') and 'author' in self.fields:
+            self.fields.pop('author')
+            self.fields['author_id'] = serializers.IntegerField(read_only=True)
+        if fields is not None:
+            keep = set(fields) | {'id'}
+            if 'author' in keep:
+                keep.add('author_id')
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class UserSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     subscriptions = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'department', 'role', 'image', 'subscriptions']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'department', 'role', 'image', 'image_variants', 'subscriptions']
+        list_serializer_class = TimedListSerializer
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
 
     def get_subscriptions(self, obj):
-        return list(obj.subscriptions.values_list('department', flat=True))
+        return subscribed_departments(obj.subscription_mask)
 
-class CommentSerializer(serializers.ModelSerializer):
+def authors_map(objects, request=None):
+    """Each distinct author of ``objects``, serialized once, keyed by id."""
+    authors = {}
+    for obj in objects:
+        authors.setdefault(obj.author_id, obj.author)
+    data = UserSerializer(list(authors.values()), many=True, context={'request': request}).data
+    return {str(author['id']): author for author in data}
+
+class CommentSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     
     class Meta:
         model = Comment
         fields = '__all__'
         read_only_fields = ['post']
+        list_serializer_class = TimedListSerializer
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, TimedDataMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     likes_count = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
     department = serializers.ChoiceField(choices=User.Department.choices, required=False)
     is_liked = serializers.SerializerMethodField()
     is_saved = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = '__all__'
+        read_only_fields = ['number_of_likes', 'number_of_comments', 'top_score', 'hot_score']
+        list_serializer_class = TimedListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset, request=None):
+        """
+        Prepare a Post queryset so a whole page serializes in a fixed number
+        of queries: the requesting user's like/save flags become annotations,
+        authors are joined. Counts come from the stored counter columns.
+        """
+        queryset = queryset.select_related('author')
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return queryset.annotate(
+                annotated_is_liked=Exists(LikedPost.objects.filter(post=OuterRef('pk'), user=user)),
+                annotated_is_saved=Exists(SavedPost.objects.filter(post=OuterRef('pk'), user=user)),
+            )
+        return queryset.annotate(annotated_is_liked=Value(False), annotated_is_saved=Value(False))
 
     def validate(self, data):
         request = self.context.get('request')
@@ -52,18 +125,25 @@ class PostSerializer(serializers.ModelSerializer):
         return data
 
     def get_likes_count(self, obj):
-        return obj.get_likes_count()
+        return obj.number_of_likes
 
     def get_comments_count(self, obj):
-        return obj.get_comments_count()
+        return obj.number_of_comments
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
 
     def get_is_liked(self, obj):
+        if hasattr(obj, 'annotated_is_liked'):
+            return obj.annotated_is_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return LikedPost.objects.filter(post=obj, user=request.user).exists()
         return False
 
     def get_is_saved(self, obj):
+        if hasattr(obj, 'annotated_is_saved'):
+            return obj.annotated_is_saved
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return SavedPost.objects.filter(post=obj, user=request.user).exists()
@@ -71,7 +151,7 @@ class PostSerializer(serializers.ModelSerializer):
 
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedDataMixin, serializers.ModelSerializer):
     department = serializers.SerializerMethodField()
     message = serializers.SerializerMethodField()
     time = serializers.SerializerMethodField()
@@ -85,6 +165,7 @@ class NotificationSerializer(serializers.ModelSerializer):
             'time',
             'is_read',
         ]
+        list_serializer_class = TimedListSerializer
 
     def get_department(self, obj):
         if obj.post and obj.post.department:
@@ -97,4 +178,39 @@ class NotificationSerializer(serializers.ModelSerializer):
         return "New notification"
 
     def get_time(self, obj):
-        return obj.created_at
\ No newline at end of file
+        return obj.created_at
+
+
+# Same shape as NotificationSerializer, built from a Post annotated with
+# is_read by notifications.pull_notifications (NOTIFICATION_MODE = 'pull').
+class PostNotificationSerializer(TimedDataMixin, serializers.ModelSerializer):
+    department = serializers.SerializerMethodField()
+    message = serializers.SerializerMethodField()
+    time = serializers.SerializerMethodField()
+    is_read = serializers.BooleanField()
+
+    class Meta:
+        model = Post
+        fields = [
+            'id',
+            'department',
+            'message',
+            'time',
+            'is_read',
+        ]
+        list_serializer_class = TimedListSerializer
+
+    def get_department(self, obj):
+        return obj.department or "General"
+
+    def get_message(self, obj):
+        return obj.title
+
+    def get_time(self, obj):
+        return obj.created_at
+
+    def update(self, instance, validated_data):
+        if 'is_read' in validated_data:
+            mark_post_read(self.context['request'].user, instance, validated_data['is_read'])
+            instance.is_read = validated_data['is_read']
+        return instance
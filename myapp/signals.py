@@ -1,23 +1,170 @@
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import Post, DepartmentSubscription, Notification
+from .models import User, Post, Comment, DepartmentSubscription
+from .tasks import run_in_background, fan_out_post_notifications
+from .images import needs_variants, generate_image_variants
+from .notifications import pull_mode
+from .cache import (
+    ALL_DEPARTMENTS, bump_author_versions, bump_post_versions, bump_user_version, bump_versions, post_scope,
+)
+from .scores import post_count, recomputed_scores, score_changes
+from .subscriptions import DEPARTMENT_BITS, mask_changes
+from . import timeline
 
 @receiver(post_save, sender=Post)
 def create_notifications(sender, instance, created, **kwargs):
+    # In pull mode notifications are derived from posts at read time.
+    if created and not pull_mode():
+        # Fan out once the post is committed, off the request thread.
+        transaction.on_commit(partial(
+            run_in_background,
+            fan_out_post_notifications,
+            instance.pk,
+            instance.author_id,
+            instance.department,
+        ))
+
+
+@receiver(post_save, sender=Post)
+def update_timelines(sender, instance, created, **kwargs):
+    if timeline.timeline_enabled():
+        task = timeline.fan_out_post if created else timeline.refresh_post
+        transaction.on_commit(partial(run_in_background, task, instance.pk))
+
+
+@receiver(post_save, sender=DepartmentSubscription)
+def add_to_subscription_mask(sender, instance, created, **kwargs):
     if created:
-        author_department = instance.department
-        # Find users subscribed to this department
-        subscriptions = DepartmentSubscription.objects.filter(department=author_department)
-        
-        notifications = []
-        for sub in subscriptions:
-            # Don't notify the author themselves
-            if sub.user != instance.author:
-                notifications.append(
-                    Notification(
-                        recipient=sub.user,
-                        post=instance
-                    )
-                )
-        
-        Notification.objects.bulk_create(notifications)
+        _update_subscription_mask(instance, following=True)
+
+@receiver(post_delete, sender=DepartmentSubscription)
+def remove_from_subscription_mask(sender, instance, **kwargs):
+    _update_subscription_mask(instance, following=False)
+
+def _update_subscription_mask(subscription, following):
+    User.objects.filter(pk=subscription.user_id).update(**mask_changes(subscription.department, following))
+    # The update() sends no post_save for the user, so drop the copy cached
+    # by CachedJWTAuthentication here; authors also show their
+    # subscriptions on cached post pages.
+    bump_user_version(subscription.user_id)
+    bump_author_versions(subscription.user_id)
+    # Keep a loaded user (request.user, or the new user in
+    # create_general_subscription) in step without re-reading it.
+    if DepartmentSubscription.user.is_cached(subscription):
+        bit = DEPARTMENT_BITS[subscription.department]
+        user = subscription.user
+        user.subscription_mask = user.subscription_mask | bit if following else user.subscription_mask & ~bit
+
+
+# Following back-fills the timeline and unfollowing trims it, in the same
+# transaction; bulk-created subscriptions need `manage.py rebuild_timelines`.
+@receiver(post_save, sender=DepartmentSubscription)
+def add_department_to_timeline(sender, instance, created, **kwargs):
+    if created and timeline.timeline_enabled():
+        timeline.add_department(instance.user_id, instance.department)
+
+@receiver(post_delete, sender=DepartmentSubscription)
+def remove_department_from_timeline(sender, instance, **kwargs):
+    if timeline.timeline_enabled():
+        timeline.remove_department(instance.user_id, instance.department)
+
+
+# Profile, role and password changes all save the user row; the bump drops
+# the copy cached by CachedJWTAuthentication.
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    bump_user_version(instance.pk)
+
+
+# What UserSerializer shows of a post's author; saves touching only other
+# fields (last_login, password) leave cached post pages alone. Deleting a
+# user deletes their posts, which bumps them.
+AUTHOR_FIELDS = frozenset([
+    'username', 'email', 'first_name', 'last_name', 'department', 'role', 'image', 'image_variants',
+    'subscription_mask',
+])
+
+@receiver(post_save, sender=User)
+def invalidate_author_pages(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not AUTHOR_FIELDS.intersection(update_fields)):
+        return
+    bump_author_versions(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def invalidate_post_cache_on_save(sender, instance, created, **kwargs):
+    # An edit may have moved the post out of its old department.
+    bump_post_versions(instance.pk, instance.department if created else None)
+
+@receiver(post_delete, sender=Post)
+def invalidate_post_cache_on_delete(sender, instance, **kwargs):
+    bump_post_versions(instance.pk, instance.department)
+
+
+def _comment_department(comment):
+    # Avoid a query when the post isn't loaded (e.g. cascades); None bumps
+    # every department instead.
+    if Comment.post.is_cached(comment):
+        return comment.post.department
+    return None
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            number_of_comments=F('number_of_comments') + 1, **score_changes(comments=1)
+        )
+        bump_post_versions(instance.post_id, _comment_department(instance))
+
+def _deleted_model(origin):
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+# Also fires for every comment removed by a cascade. Comments of a deleted
+# post go with it, and those of a deleted user are recounted once per post
+# by recount_comments_of_deleted_user, so neither touches the post here.
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, origin=None, **kwargs):
+    if _deleted_model(origin) in (Post, User):
+        return
+    Post.objects.filter(pk=instance.post_id).update(
+        number_of_comments=F('number_of_comments') - 1, **score_changes(comments=-1)
+    )
+    bump_post_versions(instance.post_id, _comment_department(instance))
+
+@receiver(pre_delete, sender=User)
+def find_posts_commented_by_deleted_user(sender, instance, **kwargs):
+    # Their own posts are deleted along with them.
+    instance._commented_posts = dict(Comment.objects.filter(author=instance).exclude(
+        post__author=instance
+    ).values_list('post_id', 'post__department').distinct())
+
+@receiver(post_delete, sender=User)
+def recount_comments_of_deleted_user(sender, instance, **kwargs):
+    commented = getattr(instance, '_commented_posts', None)
+    if not commented:
+        return
+    posts = Post.objects.filter(pk__in=commented)
+    posts.update(number_of_comments=post_count(Comment))
+    posts.update(**recomputed_scores())
+    bump_versions(
+        {ALL_DEPARTMENTS}
+        | {department for department in commented.values() if department}
+        | {post_scope(post_id) for post_id in commented}
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+def schedule_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance):
+        transaction.on_commit(partial(
+            run_in_background,
+            generate_image_variants,
+            sender._meta.label,
+            instance.pk,
+        ))
@@ -0,0 +1,52 @@
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import User, DepartmentSubscription
+
+# Department -> bit in User.subscription_mask. New departments must be
+# appended to User.Department; reordering it would reassign bits.
+DEPARTMENT_BITS = {department: 1 << index for index, department in enumerate(User.Department.values)}
+
+
+def subscribed_departments(mask):
+    """Departments in ``mask``, in User.Department order."""
+    return [department for department, bit in DEPARTMENT_BITS.items() if mask & bit]
+
+
+def subscription_mask(departments):
+    mask = 0
+    for department in departments:
+        mask |= DEPARTMENT_BITS[department]
+    return mask
+
+
+def mask_subquery(subscriptions):
+    """
+    Expression for a user's mask computed from ``subscriptions`` (a
+    DepartmentSubscription manager or queryset). Each (user, department)
+    pair is unique, so summing the bits ORs them.
+    """
+    bits = Case(
+        *[When(department=department, then=Value(bit)) for department, bit in DEPARTMENT_BITS.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    masks = subscriptions.filter(user=OuterRef('pk')).order_by().values('user').annotate(
+        mask=Sum(bits)
+    ).values('mask')
+    return Coalesce(Subquery(masks, output_field=IntegerField()), 0)
+
+
+def sync_subscription_masks(user_ids=None):
+    """Recompute masks from DepartmentSubscription, e.g. after bulk_create. Returns users updated."""
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    return users.update(subscription_mask=mask_subquery(DepartmentSubscription.objects))
+
+
+def mask_changes(department, following):
+    """update() kwargs that set or clear ``department`` without reading the row first."""
+    bit = DEPARTMENT_BITS[department]
+    mask = F('subscription_mask').bitor(bit) if following else F('subscription_mask').bitand(~bit)
+    return {'subscription_mask': mask}
@@ -0,0 +1,63 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Post, DepartmentSubscription, Notification
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_TASKS_WORKERS', 2),
+                thread_name_prefix='myapp-tasks',
+            )
+        return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        # Worker threads get their own connections; don't leak them.
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run ``func`` on the in-process worker pool, or inline when
+    BACKGROUND_TASKS_ASYNC is off (tests, management commands).
+    """
+    if not getattr(settings, 'BACKGROUND_TASKS_ASYNC', True):
+        return func(*args, **kwargs)
+    return _get_executor().submit(_run, func, args, kwargs)
+
+
+def fan_out_post_notifications(post_id, author_id, department):
+    if not Post.objects.filter(pk=post_id).exists():
+        return
+
+    batch_size = getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE', 500)
+    subscriber_ids = DepartmentSubscription.objects.filter(
+        department=department
+    ).exclude(user_id=author_id).order_by('user_id').values_list('user_id', flat=True)
+
+    batch = []
+    for user_id in subscriber_ids.iterator(chunk_size=batch_size):
+        batch.append(Notification(recipient_id=user_id, post_id=post_id))
+        if len(batch) >= batch_size:
+            Notification.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Notification.objects.bulk_create(batch)
@@ -1,2 +1,1509 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F, Max
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import (
+    User, Post, Comment, LikedPost, SavedPost, Notification, DepartmentSubscription, NotificationWatermark,
+    TimelineEntry,
+)
+from .metrics import registry
+from .pagination import KeysetPagination
+from .routers import PrimaryReplicaRouter
+from .search import search_posts
+from .subscriptions import subscribed_departments, sync_subscription_masks
+from . import timeline
+
+
+def make_user(username, **kwargs):
+    kwargs.setdefault('email', f'{username}@example.com')
+    kwargs.setdefault('first_name', username)
+    kwargs.setdefault('last_name', 'Test')
+    return User.objects.create_user(username=username, **kwargs)
+
+
+@override_settings(BACKGROUND_TASKS_ASYNC=False)
+class NewsletterTestCase(TestCase):
+    def setUp(self):
+        # The locmem cache outlives each test's database transaction.
+        cache.clear()
+
+
+def make_posts(author, count, department=User.Department.General):
+    return [
+        Post.objects.create(author=author, title=f'Post {i}', content='Body', department=department)
+        for i in range(count)
+    ]
+
+
+class KeysetPaginationTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.author = make_user('author')
+
+    def collect_pages(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_post_list_walks_every_post_once(self):
+        posts = make_posts(self.author, 7)
+        # Identical timestamps must still page deterministically on id.
+        Post.objects.update(created_at=posts[0].created_at)
+
+        ids, pages = self.collect_pages(reverse('post_list') + '?page_size=3')
+
+        self.assertEqual(ids, sorted((p.id for p in posts), reverse=True))
+        self.assertEqual(pages, 3)
+
+    def test_liked_posts_are_ordered_by_like(self):
+        posts = make_posts(self.author, 4)
+        for post in [posts[2], posts[0], posts[3]]:
+            LikedPost.objects.create(user=self.author, post=post)
+
+        ids, _ = self.collect_pages(
+            reverse('user_liked_posts', args=[self.author.username]) + '?page_size=2'
+        )
+
+        self.assertEqual(ids, [posts[3].id, posts[0].id, posts[2].id])
+
+    def test_pagination_does_not_count(self):
+        make_posts(self.author, 5)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('post_list') + '?page_size=2')
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn('count', response.data)
+        post_counts = [
+            q for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT COUNT(*)') and 'FROM "myapp_post"' in q['sql']
+        ]
+        self.assertEqual(post_counts, [])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('post_list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_must_match_the_sort_keys(self):
+        make_posts(self.author, 2)
+        cursors = [
+            ['garbage', 1],
+            [{'a': 1}, 1],
+            ['2024-01-01T00:00:00', 'x'],
+            ['2024-01-01T00:00:00+00:00', 1.5],
+            [True, 1],
+        ]
+        for position in cursors:
+            cursor = KeysetPagination().encode_cursor(position)
+            for url in ('/posts/', '/async/posts/', '/users/author/liked/', '/posts/search/?q=post'):
+                with self.subTest(position=position, url=url):
+                    separator = '&' if '?' in url else '?'
+                    response = self.client.get(f'{url}{separator}cursor={cursor}')
+                    self.assertEqual(response.status_code, 404)
+
+
+class PostQueryBudgetTests(NewsletterTestCase):
+    # One query for the page of posts; authors are joined and carry their
+    # subscriptions in subscription_mask.
+    FEED_QUERY_BUDGET = 1
+    # Cached pages still look up the reader's likes and saves on the page.
+    USER_FLAG_QUERIES = 2
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+
+    def make_feed(self, authors, posts_per_author):
+        for n in range(authors):
+            author = make_user(f'writer{n}')
+            for post in make_posts(author, posts_per_author):
+                LikedPost.objects.create(user=self.reader, post=post)
+                SavedPost.objects.create(user=author, post=post)
+                Comment.objects.create(post=post, author=author, content='Nice')
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def test_feed_query_count_is_independent_of_page_size(self):
+        self.make_feed(authors=5, posts_per_author=6)
+
+        for page_size in (5, 30):
+            with self.assertNumQueries(self.FEED_QUERY_BUDGET + self.USER_FLAG_QUERIES):
+                response = self.client.get(reverse('post_list') + f'?page_size={page_size}')
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_followed_feed_stays_within_budget(self):
+        self.make_feed(authors=3, posts_per_author=4)
+
+        # The reader's subscriptions come from request.user.subscription_mask.
+        with self.assertNumQueries(self.FEED_QUERY_BUDGET):
+            response = self.client.get(reverse('followed-departments-posts'))
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_annotated_fields_match_per_object_values(self):
+        self.make_feed(authors=2, posts_per_author=2)
+
+        response = self.client.get(reverse('post_list'))
+
+        for item in response.data['results']:
+            post = Post.objects.get(pk=item['id'])
+            self.assertEqual(item['likes_count'], post.get_likes_count())
+            self.assertEqual(item['comments_count'], post.get_comments_count())
+            self.assertTrue(item['is_liked'])
+            self.assertFalse(item['is_saved'])
+            self.assertEqual(item['author']['subscriptions'], ['General'])
+
+
+class QueryPlanTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        posts = make_posts(self.reader, 3) + make_posts(self.reader, 3, department=User.Department.Dev)
+        for post in posts:
+            LikedPost.objects.create(user=self.reader, post=post)
+            SavedPost.objects.create(user=self.reader, post=post)
+            Comment.objects.create(post=post, author=self.reader, content='Nice')
+            Notification.objects.create(recipient=self.reader, post=post)
+
+    def full_scans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        scans = []
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if detail.startswith('SCAN') and 'USING' not in detail:
+                        scans.append((detail, query['sql']))
+        return response, scans
+
+    def test_list_endpoints_use_indexes(self):
+        username = self.reader.username
+        post_id = Post.objects.order_by('id').first().id
+        urls = [
+            reverse('post_list'),
+            reverse('post_list') + '?department=Development',
+            reverse('followed-departments-posts'),
+            reverse('post_list') + '?ordering=hot',
+            reverse('post_list') + '?ordering=top&department=Development',
+            reverse('followed-departments-posts') + '?ordering=hot',
+            reverse('user_liked_posts', args=[username]),
+            reverse('user_saved_posts', args=[username]),
+            reverse('post_comment_list', args=[post_id]),
+            reverse('notifications'),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response, scans = self.full_scans(url + ('&' if '?' in url else '?') + 'page_size=2')
+                self.assertEqual(scans, [])
+                # Second pages seek into the index through the cursor.
+                if response.data['next']:
+                    _, scans = self.full_scans(response.data['next'])
+                    self.assertEqual(scans, [])
+
+
+class LikeCounterTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = make_user('liker')
+        self.client.force_authenticate(self.user)
+        self.post = make_posts(make_user('author'), 1)[0]
+
+    def test_toggle_updates_counter(self):
+        url = reverse('like_post', args=[self.post.pk])
+
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.number_of_likes, 1)
+
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.number_of_likes, 0)
+        self.assertFalse(LikedPost.objects.exists())
+
+    def test_toggle_only_writes_the_counter_column(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('like_post', args=[self.post.pk]))
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"title"', updates[0])
+
+    def test_reconcile_counters_fixes_drift(self):
+        LikedPost.objects.create(user=self.user, post=self.post)
+        Comment.objects.create(post=self.post, author=self.user, content='Hi')
+        Post.objects.filter(pk=self.post.pk).update(number_of_likes=7, number_of_comments=-3)
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.number_of_likes, self.post.number_of_comments), (1, 1))
+        self.assertIn('1 posts', out.getvalue())
+
+    def test_reconcile_counters_invalidates_cached_pages(self):
+        LikedPost.objects.create(user=self.user, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(number_of_likes=7)
+        detail_url = reverse('post_detail', args=[self.post.pk])
+        self.assertEqual(self.client.get(detail_url).data['likes_count'], 7)
+        self.assertEqual(self.client.get(reverse('post_list')).data['results'][0]['likes_count'], 7)
+
+        call_command('reconcile_counters', stdout=StringIO())
+
+        self.assertEqual(self.client.get(detail_url).data['likes_count'], 1)
+        self.assertEqual(self.client.get(reverse('post_list')).data['results'][0]['likes_count'], 1)
+
+
+class CommentCounterTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = make_user('commenter')
+        self.client.force_authenticate(self.user)
+        self.post = make_posts(make_user('author'), 1)[0]
+
+    def test_counter_follows_create_and_delete(self):
+        url = reverse('post_comment_list', args=[self.post.pk])
+        for _ in range(3):
+            self.assertEqual(self.client.post(url, {'content': 'Hello'}).status_code, 201)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.number_of_comments, 3)
+
+        Comment.objects.filter(post=self.post).first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.number_of_comments, 2)
+
+    def test_cascade_from_user_deletion_decrements(self):
+        Comment.objects.create(post=self.post, author=self.user, content='Bye')
+        Comment.objects.create(post=self.post, author=self.user, content='Bye again')
+        Comment.objects.create(post=self.post, author=self.post.author, content='Stay')
+        detail_url = reverse('post_detail', args=[self.post.pk])
+        self.assertEqual(self.client.get(detail_url).data['comments_count'], 3)
+
+        self.user.delete()
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.number_of_comments, 1)
+        self.assertEqual(self.post.top_score, 2)
+        self.assertEqual(APIClient().get(detail_url).data['comments_count'], 1)
+
+    def test_cascades_do_not_update_per_comment(self):
+        other = make_posts(self.post.author, 1)[0]
+        for post in (self.post, other):
+            for _ in range(5):
+                Comment.objects.create(post=post, author=self.user, content='Hi')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.post.delete()
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "myapp_post"')])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.user.delete()
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "myapp_post"')]), 2)
+        other.refresh_from_db()
+        self.assertEqual(other.number_of_comments, 0)
+
+    def test_feed_does_not_aggregate_comments(self):
+        Comment.objects.create(post=self.post, author=self.user, content='Hi')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('post_list'))
+        self.assertEqual(response.data['results'][0]['comments_count'], 1)
+        self.assertFalse(any('myapp_comment' in q['sql'] for q in ctx.captured_queries))
+
+
+@override_settings(NOTIFICATION_FANOUT_BATCH_SIZE=3)
+class NotificationFanOutTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('author')
+        self.subscribers = [make_user(f'member{n}') for n in range(7)]
+
+    def test_fan_out_runs_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = make_posts(self.author, 1)[0]
+            self.assertFalse(Notification.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        recipients = set(Notification.objects.filter(post=post).values_list('recipient_id', flat=True))
+        self.assertEqual(recipients, {user.pk for user in self.subscribers})
+
+    def test_fan_out_batches_and_skips_user_lookups(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            make_posts(self.author, 1)
+
+        # exists() + subscriber ids + ceil(7 / 3) inserts; no User rows loaded.
+        with CaptureQueriesContext(connection) as ctx:
+            for callback in callbacks:
+                callback()
+        self.assertEqual(len(ctx.captured_queries), 5)
+        self.assertFalse(any('FROM "myapp_user"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_only_department_subscribers_are_notified(self):
+        DepartmentSubscription.objects.create(user=self.subscribers[0], department=User.Department.HR)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = make_posts(self.author, 1, department=User.Department.HR)[0]
+
+        self.assertEqual(
+            list(Notification.objects.filter(post=post).values_list('recipient_id', flat=True)),
+            [self.subscribers[0].pk],
+        )
+
+
+@override_settings(NOTIFICATION_MODE='pull')
+class PullNotificationTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        self.author = make_user('author')
+        DepartmentSubscription.objects.create(user=self.reader, department=User.Department.Dev)
+
+    def test_posts_in_followed_departments_become_notifications(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            general = make_posts(self.author, 2)
+            dev = make_posts(self.author, 1, department=User.Department.Dev)
+            make_posts(self.author, 1, department=User.Department.HR)
+            make_posts(self.reader, 1)
+
+        self.assertFalse(Notification.objects.exists())
+        response = self.client.get(reverse('notifications'))
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [dev[0].id, general[1].id, general[0].id],
+        )
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'department', 'message', 'time', 'is_read'},
+        )
+
+    def test_marking_read_advances_the_department_watermark(self):
+        posts = make_posts(self.author, 3)
+        url = reverse('notification_detail', args=[posts[1].pk])
+
+        self.assertEqual(self.client.patch(url, {'is_read': True}).status_code, 200)
+
+        response = self.client.get(reverse('notifications'))
+        read = {item['id']: item['is_read'] for item in response.data['results']}
+        self.assertEqual(read, {posts[0].id: True, posts[1].id: True, posts[2].id: False})
+        self.assertEqual(NotificationWatermark.objects.get().last_read_post_id, posts[1].id)
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_convert_notifications_keeps_unread_items_unread(self):
+        posts = make_posts(self.author, 4)
+        for post, is_read in zip(posts, [True, True, False, True]):
+            Notification.objects.create(recipient=self.reader, post=post, is_read=is_read)
+
+        call_command('convert_notifications', '--delete-rows', stdout=StringIO())
+
+        self.assertFalse(Notification.objects.exists())
+        response = self.client.get(reverse('notifications'))
+        read = {item['id']: item['is_read'] for item in response.data['results']}
+        self.assertEqual(read, {posts[0].id: True, posts[1].id: True, posts[2].id: False, posts[3].id: False})
+
+
+class PostCacheTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.author = make_user('author')
+        self.posts = make_posts(self.author, 3, department=User.Department.Dev)
+
+    def test_anonymous_feed_is_served_from_cache(self):
+        url = reverse('post_list') + '?department=Development'
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.data, second.data)
+
+    def test_user_flags_are_merged_after_cache_read(self):
+        reader = make_user('reader')
+        LikedPost.objects.create(user=reader, post=self.posts[0])
+        self.client.force_authenticate(self.author)
+        self.client.get(reverse('post_list'))
+
+        self.client.force_authenticate(reader)
+        response = self.client.get(reverse('post_list'))
+        liked = {item['id']: item['is_liked'] for item in response.data['results']}
+        self.assertEqual(liked, {self.posts[0].id: True, self.posts[1].id: False, self.posts[2].id: False})
+
+        detail = self.client.get(reverse('post_detail', args=[self.posts[0].pk]))
+        self.assertTrue(detail.data['is_liked'])
+
+    def test_likes_and_new_posts_invalidate_cached_pages(self):
+        feed = reverse('post_list') + '?department=Development'
+        detail = reverse('post_detail', args=[self.posts[0].pk])
+        self.client.get(feed)
+        self.client.get(detail)
+
+        self.client.force_authenticate(make_user('liker'))
+        self.client.post(reverse('like_post', args=[self.posts[0].pk]))
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.client.get(detail).data['likes_count'], 1)
+        self.assertEqual(self.client.get(feed).data['results'][-1]['likes_count'], 1)
+
+        new_post = make_posts(self.author, 1, department=User.Department.Dev)[0]
+        self.assertEqual(self.client.get(feed).data['results'][0]['id'], new_post.id)
+
+    def test_author_changes_invalidate_cached_pages(self):
+        feed = reverse('post_list') + '?department=Development'
+        detail = reverse('post_detail', args=[self.posts[0].pk])
+        self.client.get(feed)
+        self.client.get(detail)
+
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        DepartmentSubscription.objects.create(user=self.author, department=User.Department.HR)
+
+        author = self.client.get(detail).data['author']
+        self.assertEqual((author['first_name'], author['subscriptions']), ('Renamed', ['General', 'HR']))
+        author = self.client.get(feed).data['results'][0]['author']
+        self.assertEqual((author['first_name'], author['subscriptions']), ('Renamed', ['General', 'HR']))
+
+    def test_logins_keep_cached_pages(self):
+        feed = reverse('post_list') + '?department=Development'
+        self.client.get(feed)
+
+        self.author.save(update_fields=['last_login'])
+
+        with self.assertNumQueries(0):
+            self.client.get(feed)
+
+    def test_other_departments_keep_their_cache(self):
+        feed = reverse('post_list') + '?department=Development'
+        self.client.get(feed)
+
+        make_posts(self.author, 1, department=User.Department.HR)
+
+        with self.assertNumQueries(0):
+            self.client.get(feed)
+
+
+class ConditionalRequestTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        self.author = make_user('author')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts = make_posts(self.author, 2)
+
+    def assert_revalidates(self, url, max_queries):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(max_queries):
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        # Last-Modified is only to the second; the ETag decides.
+        third = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(third.status_code, 200)
+        return first
+
+    def test_unchanged_polls_return_304(self):
+        self.assert_revalidates(reverse('post_list'), max_queries=0)
+        self.assert_revalidates(reverse('followed-departments-posts'), max_queries=0)
+        self.assert_revalidates(reverse('notifications'), max_queries=1)
+
+    def test_likes_and_saves_change_the_post_etag(self):
+        url = reverse('post_list')
+        first = self.client.get(url)
+
+        self.client.post(reverse('save_post', args=[self.posts[0].pk]))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][-1]['is_saved'])
+
+    def test_post_edits_change_the_notification_etag(self):
+        url = reverse('notifications')
+        first = self.client.get(url)
+
+        post = Post.objects.get(pk=self.posts[0].pk)
+        post.title = 'Edited'
+        post.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Edited', [item['message'] for item in response.data['results']])
+
+    def test_reading_a_notification_changes_the_etag(self):
+        url = reverse('notifications')
+        first = self.client.get(url)
+        notification = Notification.objects.filter(recipient=self.reader).first()
+
+        self.client.patch(reverse('notification_detail', args=[notification.pk]), {'is_read': True})
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class NotificationBulkTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts = make_posts(make_user('author'), 4)
+
+    def unread(self):
+        return self.client.get(reverse('notification_unread_count')).data['unread_count']
+
+    def test_count_and_mark_up_to(self):
+        self.assertEqual(self.unread(), 4)
+        up_to = Notification.objects.filter(recipient=self.reader, post=self.posts[1]).get().pk
+
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('notification_mark_read'), {'up_to': up_to})
+
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(self.unread(), 2)
+        self.client.post(reverse('notification_mark_read'))
+        self.assertEqual(self.unread(), 0)
+
+    def test_unread_count_uses_the_partial_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.unread()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + ctx.captured_queries[-1]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('notification_unread_idx', plan)
+
+    @override_settings(NOTIFICATION_MODE='pull')
+    def test_pull_mode_moves_watermarks(self):
+        self.assertEqual(self.unread(), 4)
+
+        self.client.post(reverse('notification_mark_read'), {'up_to': self.posts[2].pk})
+        self.assertEqual(self.unread(), 1)
+        # A lower bound never moves a watermark backwards.
+        self.client.post(reverse('notification_mark_read'), {'up_to': self.posts[0].pk})
+        self.assertEqual(self.unread(), 1)
+
+
+class PostSearchTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        author = make_user('author')
+        self.title_hit = Post.objects.create(author=author, title='Django workshop', content='Hands-on session', department=User.Department.Dev)
+        self.body_hit = Post.objects.create(author=author, title='Weekly recap', content='We ran a <b>django</b> workshop', department=User.Department.HR)
+        Post.objects.create(author=author, title='Design review', content='Figma tips', department=User.Department.Design)
+
+    def search(self, query):
+        return self.client.get(reverse('post_search') + query)
+
+    def test_results_are_ranked_and_highlighted(self):
+        response = self.search('?q=django')
+
+        results = response.data['results']
+        self.assertEqual([item['id'] for item in results], [self.title_hit.id, self.body_hit.id])
+        self.assertEqual(results[0]['title_highlight'], '<mark>Django</mark> workshop')
+        self.assertIn('&lt;b&gt;<mark>django</mark>&lt;/b&gt;', results[1]['snippet'])
+
+    def test_department_filter_and_cursor(self):
+        self.assertEqual([item['id'] for item in self.search('?q=django&department=HR').data['results']], [self.body_hit.id])
+
+        first = self.search('?q=django&page_size=1')
+        second = self.client.get(first.data['next'])
+        self.assertEqual(second.data['results'][0]['id'], self.body_hit.id)
+        self.assertIsNone(second.data['next'])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.title_hit.title = 'Rust meetup'
+        self.title_hit.save()
+        self.body_hit.delete()
+
+        self.assertEqual(self.search('?q=django').data['results'], [])
+        self.assertEqual(len(self.search('?q=rus').data['results']), 1)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('?q=django"%20OR%20NOT').status_code, 200)
+        self.assertEqual(self.search('?q=').status_code, 400)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO myapp_post_fts(myapp_post_fts) VALUES ('delete-all')")
+        self.assertEqual(self.search('?q=django').data['results'], [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(len(self.search('?q=django').data['results']), 2)
+
+
+class ImageVariantTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.client = APIClient()
+        self.author = make_user('author')
+
+    def upload(self, size=(800, 600)):
+        exif = Image.Exif()
+        exif[0x010F] = 'CameraMaker'
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_post_upload_produces_resized_webp_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.author, title='Photo', content='x', image=self.upload())
+
+        response = self.client.get(reverse('post_detail', args=[post.pk]))
+        variants = response.data['image_variants']
+        self.assertEqual(
+            sorted((v['format'], v['width'], v['height']) for v in variants),
+            [('jpeg', 320, 240), ('jpeg', 640, 480), ('jpeg', 800, 600),
+             ('webp', 320, 240), ('webp', 640, 480), ('webp', 800, 600)],
+        )
+        self.assertTrue(variants[0]['url'].startswith('http://testserver/media/post_images/variants/'))
+
+        post.refresh_from_db()
+        name = post.image_variants['variants'][0]['name']
+        with post.image.storage.open(name) as variant:
+            self.assertEqual(dict(Image.open(variant).getexif()), {})
+
+    def test_original_is_stored_without_exif(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.author, title='Photo', content='x', image=self.upload())
+
+        post.refresh_from_db()
+        with post.image.open('rb') as original:
+            image = Image.open(original)
+            self.assertEqual((dict(image.getexif()), image.size), ({}, (800, 600)))
+
+    def test_replacing_an_image_deletes_its_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.author, title='Photo', content='x', image=self.upload())
+        post.refresh_from_db()
+        old_names = [variant['name'] for variant in post.image_variants['variants']]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.image = self.upload(size=(400, 300))
+            post.save()
+
+        post.refresh_from_db()
+        storage = post.image.storage
+        self.assertEqual([name for name in old_names if storage.exists(name)], [])
+        self.assertTrue(all(storage.exists(variant['name']) for variant in post.image_variants['variants']))
+
+    def test_avatar_variants_and_default_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.image = self.upload(size=(100, 100))
+            self.author.save()
+            other = make_user('other')
+
+        self.author.refresh_from_db()
+        self.assertEqual(
+            sorted(v['width'] for v in self.author.image_variants['variants']),
+            [64, 64, 100, 100],
+        )
+        # The default SVG avatar is served as is.
+        self.assertEqual(User.objects.get(pk=other.pk).image_variants, {})
+
+
+class SeedNewsletterTests(NewsletterTestCase):
+    def test_seed_is_consistent_and_reproducible(self):
+        call_command('seed_newsletter', users=30, posts=60, seed=7, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(set(User.objects.values_list('department', flat=True)) - set(User.Department.values), set())
+        self.assertEqual(
+            DepartmentSubscription.objects.filter(department=User.Department.General).count(), 30
+        )
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('0 posts', out.getvalue())
+        self.assertFalse(Notification.objects.filter(recipient_id=F('post__author_id')).exists())
+
+
+class PerformanceMetricsTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.client = APIClient()
+        self.author = make_user('author')
+        make_posts(self.author, 3)
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('post_list'))
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(PERF_SLOW_REQUEST_MS=-1)
+    def test_slow_requests_log_their_slowest_query(self):
+        with self.assertLogs('myapp.performance', 'WARNING') as logs:
+            self.client.get(reverse('post_list'))
+        self.assertIn('(post_list)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_metrics_endpoint_is_admin_only(self):
+        self.client.get(reverse('post_list'))
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        admin = make_user('admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('newsletter_request_duration_seconds_count{view="post_list"} 1', body)
+        self.assertIn('newsletter_request_serialize_seconds_bucket{view="post_list",le="+Inf"} 1', body)
+        self.assertIn('# TYPE newsletter_request_queries_total counter', body)
+
+
+# Cached feed pages would hide the async serialization path.
+@override_settings(POST_CACHE_TIMEOUT=0)
+class AsyncReadPathTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader = make_user('reader')
+        self.author = make_user('author')
+        DepartmentSubscription.objects.create(user=self.reader, department=User.Department.Dev)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts = make_posts(self.author, 3) + make_posts(self.author, 2, department=User.Department.Dev)
+        LikedPost.objects.create(user=self.reader, post=self.posts[0])
+        token = RefreshToken.for_user(self.reader).access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def assertSameResponse(self, sync_url, async_url):
+        expected = self.client.get(sync_url, HTTP_ACCEPT='application/json')
+        actual = self.client.get(async_url, HTTP_ACCEPT='application/json')
+        self.assertEqual(actual.status_code, expected.status_code)
+        # Only the path in "next" links differs.
+        self.assertEqual(actual.content.replace(b'/async/', b'/'), expected.content)
+        self.assertEqual(actual['Content-Type'], expected['Content-Type'])
+        self.assertEqual(actual.get('ETag'), expected.get('ETag'))
+        return actual
+
+    def test_responses_match_the_sync_views(self):
+        self.assertSameResponse('/posts/?page_size=2', '/async/posts/?page_size=2')
+        self.assertSameResponse('/posts/?department=Dev', '/async/posts/?department=Dev')
+        self.assertSameResponse('/posts/followed/', '/async/posts/followed/')
+        self.assertSameResponse('/notifications/', '/async/notifications/')
+        self.assertSameResponse('/users/author/', '/async/users/author/')
+        self.assertSameResponse('/users/nobody/', '/async/users/nobody/')
+        self.assertSameResponse('/posts/?cursor=junk', '/async/posts/?cursor=junk')
+
+    @override_settings(NOTIFICATION_MODE='pull')
+    def test_pull_notifications_match(self):
+        response = self.assertSameResponse('/notifications/', '/async/notifications/')
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_authentication_errors_match(self):
+        self.client.credentials()
+        self.assertSameResponse('/notifications/', '/async/notifications/')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer nonsense')
+        response = self.assertSameResponse('/posts/', '/async/posts/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    async def test_runs_under_an_async_client(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.reader).access_token))()
+        client = AsyncClient()
+        headers = {'Authorization': f'Bearer {token}'}
+        response = await client.get('/async/posts/followed/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']],
+                         [post.pk for post in reversed(self.posts)])
+        self.assertIn('Server-Timing', response)
+        response = await client.get('/async/posts/followed/', headers={**headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class PostScoreTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        self.author = make_user('author')
+
+    def scores(self, post):
+        post.refresh_from_db()
+        return post.top_score, post.hot_score
+
+    def test_likes_and_comments_move_the_scores(self):
+        post = make_posts(self.author, 1)[0]
+        self.client.post(reverse('like_post', args=[post.pk]))
+        self.assertEqual(self.scores(post)[0], 1)
+        comment = Comment.objects.create(post=post, author=self.reader, content='Nice')
+        top, hot = self.scores(post)
+        self.assertEqual(top, 3)
+        self.assertAlmostEqual(hot, 3 / 2 ** 1.5, places=3)
+
+        comment.delete()
+        self.client.post(reverse('like_post', args=[post.pk]))
+        self.assertEqual(self.scores(post), (0, 0))
+
+    def test_top_ordering_pages_by_score(self):
+        posts = make_posts(self.author, 5)
+        for post, top in zip(posts, [4, 9, 4, 0, 9]):
+            Post.objects.filter(pk=post.pk).update(top_score=top)
+
+        ids, url = [], reverse('post_list') + '?ordering=top&page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, [posts[4].pk, posts[1].pk, posts[2].pk, posts[0].pk, posts[3].pk])
+
+    def test_hot_ordering_decays_with_age(self):
+        old, new = make_posts(self.author, 2, department=User.Department.Dev)
+        DepartmentSubscription.objects.create(user=self.reader, department=User.Department.Dev)
+        Post.objects.filter(pk=old.pk).update(top_score=10, created_at=timezone.now() - timedelta(hours=20))
+        Post.objects.filter(pk=new.pk).update(top_score=2)
+        Post.objects.filter(pk=make_posts(self.author, 1)[0].pk).update(
+            top_score=50, created_at=timezone.now() - timedelta(days=30), hot_score=1.0,
+        )
+
+        out = StringIO()
+        call_command('refresh_hot_scores', stdout=out)
+        self.assertIn('Refreshed hot scores on 2 posts.', out.getvalue())
+        self.assertEqual(Post.objects.filter(hot_score=0).count(), 1)
+
+        response = self.client.get(reverse('followed-departments-posts') + '?ordering=hot')
+        self.assertEqual([item['id'] for item in response.data['results'][:2]], [new.pk, old.pk])
+        response = self.client.get(reverse('post_list') + '?ordering=top')
+        self.assertEqual(response.data['results'][0]['top_score'], 50)
+
+    def test_unknown_ordering_is_rejected(self):
+        response = self.client.get(reverse('post_list') + '?ordering=random')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+
+    def test_reconcile_counters_fixes_scores(self):
+        post = make_posts(self.author, 1)[0]
+        LikedPost.objects.create(user=self.reader, post=post)
+        Post.objects.filter(pk=post.pk).update(number_of_likes=1, top_score=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        top, hot = self.scores(post)
+        self.assertEqual(top, 1)
+        self.assertGreater(hot, 0)
+
+
+@override_settings(TIMELINE_ENABLED=True, TIMELINE_MAX_ENTRIES=4)
+class TimelineTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        self.author = make_user('author')
+
+    def publish(self, count, department=User.Department.General):
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_posts(self.author, count, department=department)
+
+    def feed_ids(self):
+        response = self.client.get(reverse('followed-departments-posts'))
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_new_posts_reach_every_follower(self):
+        posts = self.publish(2)
+        self.publish(1, department=User.Department.HR)
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list('user_id', 'post_id')),
+            {(user.pk, post.pk) for user in (self.reader, self.author) for post in posts},
+        )
+        self.assertEqual(self.feed_ids(), [posts[1].pk, posts[0].pk])
+
+    def test_new_posts_keep_timelines_at_the_cap(self):
+        posts = self.publish(6)
+        self.assertEqual(
+            sorted(TimelineEntry.objects.filter(user=self.reader).values_list('post_id', flat=True)),
+            [post.pk for post in posts[2:]],
+        )
+        self.assertEqual(TimelineEntry.objects.count(), 8)
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        dev = self.publish(5, department=User.Department.Dev)
+        general = self.publish(1)
+        url = reverse('toggle_department_follow')
+
+        self.client.post(url, {'department': User.Department.Dev})
+        # Capped at TIMELINE_MAX_ENTRIES, newest first.
+        self.assertEqual(self.feed_ids(), [general[0].pk, dev[4].pk, dev[3].pk, dev[2].pk])
+
+        self.client.post(url, {'department': User.Department.Dev})
+        self.assertEqual(self.feed_ids(), [general[0].pk])
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader, department=User.Department.Dev).exists())
+
+    def test_page_is_a_single_range_scan(self):
+        self.publish(3)
+        with CaptureQueriesContext(connection) as ctx:
+            self.feed_ids()
+        page_sql = next(q['sql'] for q in ctx.captured_queries if 'myapp_timelineentry' in q['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + page_sql)
+            plan = ' | '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('timeline_user_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_moving_a_post_moves_its_entries(self):
+        post = self.publish(1, department=User.Department.HR)[0]
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            post.department = User.Department.General
+            post.save()
+        self.assertEqual(self.feed_ids(), [post.pk])
+
+    def test_feed_read_before_the_fan_out_is_not_revalidated(self):
+        def poll_before_fan_out(change):
+            # Run the commit callbacks, but hold the timeline task back
+            # until the reader has polled.
+            with self.captureOnCommitCallbacks() as callbacks:
+                change()
+            held = [callback for callback in callbacks if getattr(callback, 'args', ())[:1] in (
+                (timeline.fan_out_post,), (timeline.refresh_post,),
+            )]
+            for callback in callbacks:
+                if callback not in held:
+                    callback()
+            etag = self.client.get(reverse('followed-departments-posts'))['ETag']
+            for callback in held:
+                callback()
+            response = self.client.get(reverse('followed-departments-posts'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            return [item['id'] for item in response.data['results']]
+
+        post = make_posts(self.author, 1, department=User.Department.HR)[0]
+        post.department = User.Department.General
+        self.assertEqual(poll_before_fan_out(post.save), [post.pk])
+        created = []
+        self.assertEqual(poll_before_fan_out(lambda: created.extend(make_posts(self.author, 1))),
+                         [created[0].pk, post.pk])
+
+    def test_rebuild_and_trim_commands(self):
+        posts = self.publish(6)
+        TimelineEntry.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_timelines', user=['reader'], stdout=out)
+        self.assertIn('Wrote 4 timeline entries.', out.getvalue())
+        self.assertEqual(self.feed_ids(), [post.pk for post in reversed(posts)][:4])
+
+        with override_settings(TIMELINE_MAX_ENTRIES=2):
+            out = StringIO()
+            call_command('rebuild_timelines', trim_only=True, stdout=out)
+        self.assertIn('Trimmed 2 timeline entries.', out.getvalue())
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 2)
+
+
+class BatchActionTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = make_user('reader')
+        self.client.force_authenticate(self.user)
+        self.posts = make_posts(make_user('author'), 3)
+
+    def test_post_actions_apply_net_changes(self):
+        first, second, third = self.posts
+        LikedPost.objects.create(user=self.user, post=third)
+        Post.objects.filter(pk=third.pk).update(number_of_likes=1)
+
+        items = [
+            {'post_id': first.pk, 'action': 'like'},
+            {'post_id': first.pk, 'action': 'like'},
+            {'post_id': second.pk, 'action': 'save'},
+            {'post_id': second.pk, 'action': 'like'},
+            {'post_id': second.pk, 'action': 'unlike'},
+            {'post_id': third.pk, 'action': 'unlike'},
+            {'post_id': 999999, 'action': 'like'},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('post_batch_actions'), items, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['result'] for item in response.data['results']],
+            ['applied', 'unchanged', 'applied', 'applied', 'applied', 'applied', 'not_found'],
+        )
+        self.assertEqual(set(LikedPost.objects.values_list('post_id', flat=True)), {first.pk})
+        self.assertEqual(set(SavedPost.objects.values_list('post_id', flat=True)), {second.pk})
+        self.assertEqual(
+            dict(Post.objects.values_list('pk', 'number_of_likes')),
+            {first.pk: 1, second.pk: 0, third.pk: 0},
+        )
+        # No per-item queries: posts, likes, saves, then one write per change kind.
+        writes = [q for q in ctx.captured_queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertLessEqual(len(writes), 5)
+
+    def test_racing_requests_do_not_move_counters_twice(self):
+        post = self.posts[0]
+        real_bulk_create = LikedPost.objects.bulk_create
+
+        def race(action, other_request):
+            # The other request runs between this one's read of the current
+            # likes and its writes (which start with the bulk insert).
+            def bulk_create(objs, **kwargs):
+                other_request()
+                return real_bulk_create(objs, **kwargs)
+
+            with mock.patch.object(LikedPost.objects, 'bulk_create', side_effect=bulk_create):
+                response = self.client.post(
+                    reverse('post_batch_actions'), [{'post_id': post.pk, 'action': action}], format='json'
+                )
+            self.assertEqual(response.status_code, 200)
+            post.refresh_from_db()
+            return post.number_of_likes, post.top_score
+
+        def like():
+            LikedPost.objects.create(user=self.user, post=post)
+            Post.objects.filter(pk=post.pk).update(number_of_likes=F('number_of_likes') + 1)
+
+        def unlike():
+            LikedPost.objects.filter(user=self.user, post=post).delete()
+            Post.objects.filter(pk=post.pk).update(number_of_likes=F('number_of_likes') - 1)
+
+        self.assertEqual(race('like', like), (1, 1))
+        self.assertEqual(race('unlike', unlike), (0, 0))
+
+    def test_invalid_batches_are_rejected(self):
+        url = reverse('post_batch_actions')
+        self.assertEqual(self.client.post(url, [], format='json').status_code, 400)
+        self.assertEqual(
+            self.client.post(url, [{'post_id': self.posts[0].pk, 'action': 'share'}], format='json').status_code,
+            400,
+        )
+        too_many = [{'post_id': self.posts[0].pk, 'action': 'like'}] * 101
+        self.assertEqual(self.client.post(url, too_many, format='json').status_code, 400)
+        self.assertFalse(LikedPost.objects.exists())
+
+    def test_follow_batch(self):
+        items = [
+            {'department': User.Department.Dev, 'action': 'follow'},
+            {'department': User.Department.HR, 'action': 'follow'},
+            {'department': User.Department.General, 'action': 'unfollow'},
+            {'department': User.Department.Dev, 'action': 'follow'},
+        ]
+        response = self.client.post(reverse('department_follow_batch'), items, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['result'] for item in response.data['results']],
+            ['applied', 'applied', 'applied', 'unchanged'],
+        )
+        self.assertEqual(
+            set(self.user.subscriptions.values_list('department', flat=True)),
+            {User.Department.Dev, User.Department.HR},
+        )
+
+
+@override_settings(POST_CACHE_TIMEOUT=0)
+class SparseFieldsTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.reader = make_user('reader')
+        self.client.force_authenticate(self.reader)
+        self.authors = [make_user('alice'), make_user('bob')]
+        self.posts = make_posts(self.authors[0], 2) + make_posts(self.authors[1], 1)
+        Comment.objects.create(post=self.posts[0], author=self.authors[1], content='Hi')
+        LikedPost.objects.create(user=self.reader, post=self.posts[0])
+
+    def test_fields_limit_post_and_user_output(self):
+        response = self.client.get('/posts/?fields=title,is_liked')
+        self.assertEqual(response.status_code, 200)
+        for item in response.data['results']:
+            self.assertEqual(set(item), {'id', 'title', 'is_liked'})
+        liked = {item['id']: item['is_liked'] for item in response.data['results']}
+        self.assertEqual(liked, {post.pk: post == self.posts[0] for post in self.posts})
+
+        response = self.client.get(f'/posts/{self.posts[0].pk}/?fields=title')
+        self.assertEqual(set(response.data), {'id', 'title'})
+        response = self.client.get('/users/alice/?fields=username')
+        self.assertEqual(response.data, {'id': self.authors[0].pk, 'username': 'alice'})
+        response = self.client.get(f'/posts/{self.posts[0].pk}/comments/?fields=content')
+        self.assertEqual([set(item) for item in response.data['results']], [{'id', 'content'}])
+
+    def test_include_authors_sideloads_each_author_once(self):
+        response = self.client.get('/posts/?include=authors')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertNotIn('author', results[0])
+        self.assertEqual(
+            sorted(item['author_id'] for item in results),
+            sorted(post.author_id for post in self.posts),
+        )
+        self.assertEqual(set(response.data['authors']), {str(author.pk) for author in self.authors})
+        self.assertEqual(response.data['authors'][str(self.authors[0].pk)]['username'], 'alice')
+
+        response = self.client.get(f'/posts/{self.posts[0].pk}/comments/?include=authors')
+        self.assertEqual(response.data['results'][0]['author_id'], self.authors[1].pk)
+        self.assertEqual(list(response.data['authors']), [str(self.authors[1].pk)])
+
+    def test_variants_are_cached_separately(self):
+        with self.settings(POST_CACHE_TIMEOUT=300):
+            full = self.client.get('/posts/')
+            sparse = self.client.get('/posts/?fields=title')
+            self.assertIn('content', full.data['results'][0])
+            self.assertNotIn('content', sparse.data['results'][0])
+            self.assertNotEqual(full['ETag'], sparse['ETag'])
+
+    def test_async_views_match(self):
+        for query in ('?fields=title,author', '?include=authors', '?fields=title&include=authors'):
+            expected = self.client.get(f'/posts/{query}', HTTP_ACCEPT='application/json')
+            actual = self.client.get(f'/async/posts/{query}', HTTP_ACCEPT='application/json')
+            self.assertEqual(actual.content.replace(b'/async/', b'/'), expected.content)
+        expected = self.client.get('/users/alice/?fields=username', HTTP_ACCEPT='application/json')
+        actual = self.client.get('/async/users/alice/?fields=username', HTTP_ACCEPT='application/json')
+        self.assertEqual(actual.content, expected.content)
+
+
+class ExportTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.admin = make_user('admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+        author = make_user('author')
+        self.posts = make_posts(author, 2) + make_posts(author, 1, department=User.Department.Dev)
+        Post.objects.filter(pk=self.posts[0].pk).update(
+            created_at=timezone.now() - timedelta(days=10), number_of_likes=1,
+        )
+        LikedPost.objects.create(user=self.admin, post=self.posts[0])
+        SavedPost.objects.create(user=self.admin, post=self.posts[0])
+        SavedPost.objects.create(user=author, post=self.posts[0])
+        Comment.objects.create(post=self.posts[2], author=author, content='a, "quoted"\nline')
+
+    def rows(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_posts_ndjson_includes_engagement_counts(self):
+        response = self.client.get('/export/posts/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = self.rows(response)
+        self.assertEqual([row['id'] for row in rows], [post.pk for post in self.posts])
+        self.assertEqual(
+            (rows[0]['number_of_likes'], rows[0]['number_of_saves'], rows[2]['number_of_comments']), (1, 2, 1),
+        )
+
+    def test_filters(self):
+        rows = self.rows(self.client.get('/export/posts/?department=Development'))
+        self.assertEqual([row['id'] for row in rows], [self.posts[2].pk])
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        rows = self.rows(self.client.get('/export/posts/', {'since': since}))
+        self.assertEqual([row['id'] for row in rows], [post.pk for post in self.posts[1:]])
+        self.assertEqual(self.rows(self.client.get('/export/likes/', {'since': since})), [])
+        self.assertEqual(self.client.get('/export/posts/?department=Nope').status_code, 400)
+        self.assertEqual(self.client.get('/export/users/').status_code, 404)
+
+    def test_csv(self):
+        response = self.client.get('/export/comments/?output=csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="comments.csv"')
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:2], ['id', 'post_id'])
+        self.assertEqual(rows[1][5], 'a, "quoted"\nline')
+
+    def test_admin_only(self):
+        self.client.force_authenticate(make_user('member'))
+        self.assertEqual(self.client.get('/export/posts/').status_code, 403)
+
+    def test_command_matches_the_endpoint(self):
+        out = StringIO()
+        call_command('export_newsletter', 'saves', '--department=General', stdout=out)
+        expected = b''.join(self.client.get('/export/saves/?department=General').streaming_content).decode()
+        self.assertEqual(out.getvalue(), expected)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class CachedJWTAuthenticationTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('reader')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def profile(self):
+        response = self.client.get('/user/profile/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_repeat_requests_skip_the_user_lookup(self):
+        self.profile()
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.profile()
+        self.assertEqual(data['subscriptions'], [User.Department.General])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_changes_invalidate_the_cached_user(self):
+        self.profile()
+        response = self.client.post('/users/reader/update-role/', {'role': User.Role.Manager})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.profile()['role'], User.Role.Manager)
+
+        self.client.post('/departments/follow/', {'department': User.Department.HR})
+        self.assertEqual(set(self.profile()['subscriptions']), {User.Department.General, User.Department.HR})
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/user/profile/').status_code, 401)
+
+    def test_subscription_changes_outside_the_views_invalidate_the_cached_user(self):
+        self.profile()
+        subscription = DepartmentSubscription.objects.create(user_id=self.user.pk, department=User.Department.HR)
+        self.assertEqual(set(self.profile()['subscriptions']), {User.Department.General, User.Department.HR})
+        subscription.delete()
+        self.assertEqual(self.profile()['subscriptions'], [User.Department.General])
+
+    def test_password_change_revokes_cached_tokens(self):
+        # simplejwt rebinds its settings on setting_changed, which the
+        # already-imported copies never see; patch the shared object.
+        with mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+            self.profile()
+            self.user.set_password('a new password')
+            self.user.save()
+            self.assertEqual(self.client.get('/user/profile/').status_code, 401)
+
+    def test_privileged_views_ignore_the_cached_user(self):
+        # An update() stands in for a change made by another worker, whose
+        # version bump never reaches this process's cache.
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        self.profile()
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.assertEqual(self.client.get('/export/posts/').status_code, 401)
+
+
+class SubscriptionMaskTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = make_user('reader')
+        self.client.force_authenticate(self.user)
+
+    def assertMask(self, departments):
+        self.user.refresh_from_db()
+        self.assertEqual(subscribed_departments(self.user.subscription_mask), departments)
+        self.assertEqual(
+            set(self.user.subscriptions.values_list('department', flat=True)), set(departments),
+        )
+
+    def test_new_users_follow_general(self):
+        self.assertMask([User.Department.General])
+
+    def test_toggle_and_batch_keep_the_mask_in_step(self):
+        self.client.post(reverse('toggle_department_follow'), {'department': User.Department.Dev})
+        self.assertMask([User.Department.General, User.Department.Dev])
+        self.client.post(reverse('toggle_department_follow'), {'department': User.Department.General})
+        self.assertMask([User.Department.Dev])
+
+        self.client.post(reverse('department_follow_batch'), [
+            {'department': User.Department.HR, 'action': 'follow'},
+            {'department': User.Department.Dev, 'action': 'unfollow'},
+        ], format='json')
+        self.assertMask([User.Department.HR])
+        self.assertEqual(
+            self.client.get(f'/api/user/{self.user.pk}/followed-departments/').data, [User.Department.HR],
+        )
+
+    def test_readers_skip_the_subscription_table(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('followed-departments-posts'))
+            self.client.get('/users/reader/')
+        self.assertFalse([q for q in ctx.captured_queries if 'myapp_departmentsubscription' in q['sql']])
+
+    def test_sync_repairs_drift(self):
+        User.objects.filter(pk=self.user.pk).update(subscription_mask=0)
+        self.assertEqual(sync_subscription_masks([self.user.pk]), 1)
+        self.assertMask([User.Department.General])
+
+
+class ImportMembersTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w') as out:
+            out.write(content)
+        return path
+
+    def test_matches_creating_users_one_by_one(self):
+        path = self.write('members.csv', (
+            'email,username,first_name,last_name,department,role,password\n'
+            'ada@Example.COM,ada,Ada,L,Development,,s3cret-pass\n'
+            'bob@example.com,bob,Bob,M,,,s3cret-pass\n'
+            'cy@example.com,cy,Cy,N,HR,Manager,\n'
+        ))
+        call_command('import_members', path, workers=2, batch_size=2, stdout=StringIO())
+
+        ada, bob, cy = User.objects.order_by('pk')
+        self.assertEqual(ada.email, 'ada@example.com')
+        self.assertEqual([ada.role, bob.role, cy.role],
+                         [User.Role.President, User.Role.VicePresident, User.Role.Manager])
+        self.assertEqual([ada.department, bob.department], [User.Department.Dev, User.Department.General])
+        self.assertTrue(ada.check_password('s3cret-pass'))
+        self.assertFalse(cy.has_usable_password())
+
+        reference = make_user('reference')
+        for user in (ada, bob, cy):
+            self.assertEqual(user.subscription_mask, reference.subscription_mask)
+            self.assertEqual(list(user.subscriptions.values_list('department', flat=True)),
+                             [User.Department.General])
+
+    def test_jsonl_and_validation(self):
+        make_user('taken')
+        path = self.write('members.jsonl', '\n'.join([
+            json.dumps({'email': 'a@example.com', 'username': 'a', 'first_name': 'A', 'last_name': 'B'}),
+            json.dumps({'email': 'a@example.com', 'username': 'taken', 'first_name': 'A', 'last_name': 'B'}),
+            json.dumps({'email': 'nope', 'username': 'c', 'first_name': 'C', 'last_name': 'D', 'role': 'King'}),
+        ]))
+        with self.assertRaisesMessage(CommandError, 'Nothing imported') as raised:
+            call_command('import_members', path, workers=1)
+        message = str(raised.exception)
+        self.assertIn('line 3', message)
+        self.assertIn("email 'a@example.com' appears more than once", message)
+        self.assertIn("username 'taken' is already taken", message)
+        self.assertEqual(User.objects.count(), 1)
+
+        path = self.write('ok.jsonl', json.dumps(
+            {'email': 'a@example.com', 'username': 'a', 'first_name': 'A', 'last_name': 'B'}
+        ) + '\n')
+        call_command('import_members', path, workers=1, stdout=StringIO())
+        self.assertEqual(User.objects.get(username='a').role, User.Role.VicePresident)
+
+
+# The test database has no replica, so "default" stands in for one and the
+# tests watch for the router picking it.
+@override_settings(DATABASE_REPLICAS=['default'], POST_CACHE_TIMEOUT=0)
+class ReplicaRoutingTests(NewsletterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('reader')
+        self.post = make_posts(make_user('author'), 1)[0]
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        patcher = mock.patch('myapp.routers.random.choice', side_effect=lambda aliases: aliases[0])
+        self.choose_replica = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reads_replica(self, client, method, url, **extra):
+        self.choose_replica.reset_mock()
+        response = getattr(client, method)(url, **extra)
+        self.assertLess(response.status_code, 400)
+        return response, self.choose_replica.called
+
+    def test_only_reads_of_marked_views_use_a_replica(self):
+        client = APIClient()
+        self.assertTrue(self.reads_replica(client, 'get', '/users/author/')[1])
+        self.assertTrue(self.reads_replica(client, 'get', '/async/users/author/')[1])
+        self.assertTrue(self.reads_replica(client, 'get', f'/posts/{self.post.pk}/comments/')[1])
+        self.assertFalse(self.reads_replica(client, 'get', '/notifications/', **self.auth)[1])
+        self.assertFalse(self.reads_replica(client, 'post', f'/posts/{self.post.pk}/like/', **self.auth)[1])
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        client = APIClient()
+        self.assertTrue(self.reads_replica(client, 'get', '/users/reader/liked/', **self.auth)[1])
+
+        response, _ = self.reads_replica(client, 'post', f'/posts/{self.post.pk}/like/', **self.auth)
+        self.assertEqual(response.cookies['db_primary']['max-age'], 5)
+        # The cookie pins this client, the cache pins the user on any client.
+        self.assertFalse(self.reads_replica(client, 'get', '/users/author/')[1])
+        self.assertFalse(self.reads_replica(APIClient(), 'get', '/users/reader/liked/', **self.auth)[1])
+        self.assertTrue(self.reads_replica(APIClient(), 'get', '/users/author/')[1])
+
+    @contextmanager
+    def lagging_replica(self):
+        """Reads routed to the replica don't see posts created inside the block."""
+        synced = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+        snapshot = f'(SELECT * FROM "myapp_post" WHERE "id" <= {synced}) AS "myapp_post"'
+
+        def behind(execute, sql, params, many, context):
+            if self.choose_replica.called:
+                self.choose_replica.reset_mock()
+                sql = re.sub(r'(FROM|JOIN) "myapp_post"(?! AS)', rf'\1 {snapshot}', sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(behind):
+            yield
+
+    @override_settings(POST_CACHE_TIMEOUT=300)
+    def test_pages_are_not_built_from_a_lagging_replica(self):
+        # Feeds are cached, and revalidated by ETag, under the versions the
+        # write has already bumped, so a stale page would outlive the lag.
+        writer, follower = APIClient(), APIClient()
+        follower.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(make_user("follower")).access_token}')
+        with self.lagging_replica():
+            response = writer.post(reverse('post_list'), {
+                'title': 'Fresh', 'content': 'Body', 'department': User.Department.General,
+            }, **self.auth)
+            self.assertEqual(response.status_code, 201)
+            created = response.data['id']
+
+            for client, url in [
+                (APIClient(), reverse('post_list')), (APIClient(), '/async/posts/'), (writer, reverse('post_list')),
+                (follower, '/posts/followed/'), (follower, '/async/posts/followed/'),
+            ]:
+                with self.subTest(url=url):
+                    response = client.get(url)
+                    self.assertIn(created, [post['id'] for post in response.json()['results']])
+            self.assertEqual(APIClient().get(reverse('post_detail', args=[created])).json()['title'], 'Fresh')
+
+    def test_search_reads_through_the_router(self):
+        with mock.patch.object(PrimaryReplicaRouter, 'db_for_read', return_value='default') as db_for_read:
+            hits = search_posts('post')
+        self.assertEqual([hit.id for hit in hits], [self.post.pk])
+        db_for_read.assert_called_once_with(Post)
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(PrimaryReplicaRouter().allow_migrate('default', 'myapp'))
+        with self.settings(DATABASE_REPLICAS=['replica1']):
+            self.assertFalse(PrimaryReplicaRouter().allow_migrate('replica1', 'myapp'))
+            self.assertIsNone(PrimaryReplicaRouter().allow_migrate('default', 'myapp'))
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from .cache import bump_post_versions
+from .models import Post, DepartmentSubscription, TimelineEntry
+from .scores import FEED_ORDERINGS
+
+
+def timeline_enabled():
+    return getattr(settings, 'TIMELINE_ENABLED', False)
+
+
+def timeline_cap():
+    return getattr(settings, 'TIMELINE_MAX_ENTRIES', 1000)
+
+
+def _batch_size():
+    return getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE', 500)
+
+
+def followed_queryset(user, departments, ordering):
+    """
+    Queryset and keyset ordering for the followed-departments feed. The
+    "new" feed is read from the materialized timeline when it is enabled;
+    ranked feeds always filter posts by department.
+    """
+    if timeline_enabled() and ordering == FEED_ORDERINGS['new']:
+        queryset = Post.objects.filter(timeline_entries__user=user).annotate(
+            timeline_created_at=F('timeline_entries__created_at'),
+            timeline_post_id=F('timeline_entries__post'),
+        )
+        return queryset, ('-timeline_created_at', '-timeline_post_id')
+    return Post.objects.filter(department__in=departments), ordering
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=_batch_size(), ignore_conflicts=True)
+
+
+def fan_out_post(post_id):
+    """Add a post to the timeline of every follower of its department, author included."""
+    post = Post.objects.filter(pk=post_id).values('department', 'created_at').first()
+    if post is None or not post['department']:
+        return
+
+    batch_size = _batch_size()
+    follower_ids = DepartmentSubscription.objects.filter(
+        department=post['department']
+    ).order_by('user_id').values_list('user_id', flat=True)
+
+    batch = []
+    for user_id in follower_ids.iterator(chunk_size=batch_size):
+        batch.append(TimelineEntry(user_id=user_id, post_id=post_id, **post))
+        if len(batch) >= batch_size:
+            _insert(batch)
+            _trim_full([entry.user_id for entry in batch])
+            batch = []
+    if batch:
+        _insert(batch)
+        _trim_full([entry.user_id for entry in batch])
+    # This runs after the commit, so after the post's own bump; a followed
+    # feed read in between must not stay valid without the post.
+    bump_post_versions(post_id, post['department'])
+
+
+def _trim_full(user_ids):
+    """trim() those of ``user_ids`` whose timelines have grown past the cap."""
+    full = list(TimelineEntry.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+        total=Count('pk')
+    ).filter(total__gt=timeline_cap()).values_list('user_id', flat=True))
+    if full:
+        trim(full)
+
+
+def refresh_post(post_id):
+    """Move an edited post to the right timelines if its department changed."""
+    post = Post.objects.filter(pk=post_id).values('department').first()
+    if post is None:
+        return
+    if not TimelineEntry.objects.filter(post_id=post_id, department=post['department']).exists():
+        entries = TimelineEntry.objects.filter(post_id=post_id)
+        departments = set(entries.values_list('department', flat=True).distinct())
+        entries.delete()
+        fan_out_post(post_id)
+        # The feeds of the department the post left, like fan_out_post's.
+        for department in departments:
+            bump_post_versions(post_id, department)
+
+
+def add_department(user_id, department):
+    """Back-fill the newest posts of a newly followed department."""
+    posts = Post.objects.filter(department=department).order_by('-created_at', '-id').values_list('id', 'created_at')
+    _insert([
+        TimelineEntry(user_id=user_id, post_id=post_id, department=department, created_at=created_at)
+        for post_id, created_at in posts[:timeline_cap()]
+    ])
+    trim([user_id])
+
+
+def remove_department(user_id, department):
+    TimelineEntry.objects.filter(user_id=user_id, department=department).delete()
+
+
+def trim(user_ids=None):
+    """Keep only the newest TIMELINE_MAX_ENTRIES entries per user. Returns rows deleted."""
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    overflow = entries.annotate(position=Window(
+        RowNumber(),
+        partition_by=F('user_id'),
+        order_by=[F('created_at').desc(), F('post_id').desc()],
+    )).filter(position__gt=timeline_cap()).values_list('pk', flat=True)
+
+    overflow_ids = list(overflow)
+    batch_size = _batch_size()
+    for start in range(0, len(overflow_ids), batch_size):
+        TimelineEntry.objects.filter(pk__in=overflow_ids[start:start + batch_size]).delete()
+    return len(overflow_ids)
+
+
+def rebuild(user_ids=None):
+    """Recreate timelines from subscriptions (every user's, or ``user_ids``). Returns rows written."""
+    entries = TimelineEntry.objects.all()
+    subscriptions = DepartmentSubscription.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+    entries.delete()
+
+    followers = {}
+    for user_id, department in subscriptions.values_list('user_id', 'department'):
+        followers.setdefault(department, []).append(user_id)
+
+    written = 0
+    batch_size = _batch_size()
+    for department, user_ids_in_department in followers.items():
+        posts = list(Post.objects.filter(department=department).order_by(
+            '-created_at', '-id'
+        ).values_list('id', 'created_at')[:timeline_cap()])
+        batch = []
+        for user_id in user_ids_in_department:
+            for post_id, created_at in posts:
+                batch.append(TimelineEntry(
+                    user_id=user_id, post_id=post_id, department=department, created_at=created_at,
+                ))
+                if len(batch) >= batch_size:
+                    _insert(batch)
+                    written += len(batch)
+                    batch = []
+        _insert(batch)
+        written += len(batch)
+    return written - trim(user_ids)
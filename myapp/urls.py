@@ -1,5 +1,5 @@
 from django.urls import path, include
-from . import views
+from . import views, async_views
 from .views import FollowedDepartmentsView, social_login, FollowedDepartmentsPostsView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -17,15 +17,27 @@ urlpatterns = [
     path('users/<str:username>/liked/', views.UserLikedPosts.as_view(), name='user_liked_posts'),
     path('users/<str:username>/saved/', views.UserSavedPosts.as_view(), name='user_saved_posts'),
     path('posts/', views.PostList.as_view(), name='post_list'),
+    path('posts/search/', views.PostSearchView.as_view(), name='post_search'),
+    path('posts/batch/', views.BatchPostActionsView.as_view(), name='post_batch_actions'),
     path('posts/<int:pk>/', views.PostDetail.as_view(), name='post_detail'),
     path('users/<str:username>/update-role/', views.UpdateUserRoleView.as_view(), name='update_user_role'),
     path('posts/<int:pk>/comments/', views.PostCommentList.as_view(), name='post_comment_list'),
     path('posts/<int:pk>/like/', views.LikePost.as_view(), name='like_post'),
     path('posts/<int:pk>/save/', views.SavePost.as_view(), name='save_post'),
     path('departments/follow/', views.ToggleDepartmentFollowView.as_view(), name='toggle_department_follow'),
+    path('departments/follow/batch/', views.BatchDepartmentFollowView.as_view(), name='department_follow_batch'),
     path('api/user/<int:user_id>/followed-departments/', FollowedDepartmentsView.as_view()),
     path('posts/followed/', FollowedDepartmentsPostsView.as_view(), name='followed-departments-posts'),
     path("api/social-login/", social_login),
     path('notifications/', views.NotificationsView,  name='notifications'),
+    path('notifications/unread-count/', views.UnreadNotificationCountView.as_view(), name='notification_unread_count'),
+    path('notifications/mark-read/', views.MarkNotificationsReadView.as_view(), name='notification_mark_read'),
     path('notifications/<int:pk>/', views.NotificationDetail.as_view(), name='notification_detail'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
+    path('export/<str:kind>/', views.ExportView.as_view(), name='export'),
+    # Async (ASGI) read path; same responses as the routes above.
+    path('async/users/<str:username>/', async_views.user_detail, name='async_user_detail'),
+    path('async/posts/', async_views.post_list, name='async_post_list'),
+    path('async/posts/followed/', async_views.followed_posts, name='async_followed_posts'),
+    path('async/notifications/', async_views.notification_list, name='async_notifications'),
 ]
\ No newline at end of file
@@ -1,75 +1,202 @@
 from rest_framework.permissions import IsAdminUser
+from rest_framework.exceptions import NotFound
 from rest_framework import serializers
 from django.shortcuts import render
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import F
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from allauth.socialaccount.providers.oauth2.client import OAuth2Client
 from dj_rest_auth.registration.views import SocialLoginView
 from .models import Post, Comment, User, LikedPost, SavedPost, DepartmentSubscription, Notification
-from .serializers import PostSerializer, UserSerializer, CommentSerializer, NotificationSerializer
-
-class UserProfileView(generics.RetrieveUpdateAPIView):
+from .serializers import (
+    PostSerializer, UserSerializer, CommentSerializer, NotificationSerializer, PostNotificationSerializer,
+    authors_map, include_authors, requested_fields,
+)
+from .notifications import (
+    pull_mode, pull_notifications, mark_post_read, notification_validators, unread_count, mark_all_read,
+)
+from .pagination import KeysetPagination
+from .search import SearchPagination
+from .cache import (
+    ALL_DEPARTMENTS, bump_post_versions, bump_user_version, cache_timeout, detail_cache_key, feed_cache_key,
+    merge_user_flags, post_feed_validators,
+)
+from .conditional import make_etag, not_modified, set_validators
+from .metrics import registry
+from .scores import feed_ordering, score_changes
+from .timeline import followed_queryset
+from . import export
+from .subscriptions import subscribed_departments
+from . import routers
+from .batch import BATCH_MAX_ITEMS, POST_ACTIONS, FOLLOW_ACTIONS, apply_post_actions, apply_follow_actions
+
+class SparseFieldsViewMixin:
+    """
+    ?fields= on GET responses, and ?include=authors on paginated ones; see
+    SparseFieldsMixin.
+    """
+    sideload_authors = True
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', requested_fields(self.request))
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_context(self):
+        return {
+            **super().get_serializer_context(),
+            'include_authors': self.sideload_authors and include_authors(self.request),
+        }
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if include_authors(self.request):
+            response.data['authors'] = authors_map(self.paginator.page, self.request)
+        return response
+
+class UserProfileView(SparseFieldsViewMixin, generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
         return self.request.user
 
-class UserDetailView(generics.RetrieveAPIView):
+class UserDetailView(SparseFieldsViewMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     lookup_field = 'username'
     permission_classes = [permissions.AllowAny]
+    replica_reads = True
 
-class PostList(generics.ListCreateAPIView):
+class PostList(SparseFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_reads = True
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def get_queryset(self):
-        queryset = Post.objects.all().order_by('-created_at')
+        queryset = Post.objects.all()
         department = self.request.query_params.get('department')
         if department:
             queryset = queryset.filter(department=department)
-        return queryset
-
-class PostDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Post.objects.all()
+        # Pages are cached and shared between users; per-user flags are
+        # merged in by list().
+        return PostSerializer.setup_eager_loading(queryset)
+
+    def list(self, request, *args, **kwargs):
+        self.cursor_ordering = feed_ordering(request)
+        department = request.query_params.get('department')
+        etag, last_modified = post_feed_validators(request, [department or ALL_DEPARTMENTS])
+        response = not_modified(request, etag)
+        if response is not None:
+            return set_validators(response, etag, last_modified)
+
+        key = feed_cache_key(request, department)
+        page = cache.get(key)
+        if page is None:
+            # The page is cached, and validated, under versions a write may
+            # already have bumped; a lagging replica would pin its stale
+            # copy there for the whole cache timeout.
+            with routers.primary():
+                posts = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+                serializer = self.get_serializer(posts, many=True)
+                page = {'next': self.paginator.get_next_link(), 'results': list(serializer.data)}
+                if include_authors(request):
+                    page['authors'] = authors_map(posts, request)
+            cache.set(key, page, cache_timeout())
+        return set_validators(Response(
+            dict(page, results=merge_user_flags(page['results'], request.user))
+        ), etag, last_modified)
+
+class PostSearchView(generics.GenericAPIView):
+    serializer_class = PostSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = SearchPagination
+    replica_reads = True
+
+    def get(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'Search query required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        hits = self.paginator.paginate_search(text, request.query_params.get('department'), request)
+        posts = PostSerializer.setup_eager_loading(Post.objects.filter(pk__in=[hit.id for hit in hits]), request)
+        posts_by_id = {post.pk: post for post in posts}
+
+        results = []
+        for hit in hits:
+            if hit.id not in posts_by_id:
+                continue
+            item = dict(self.get_serializer(posts_by_id[hit.id]).data)
+            item.update(rank=hit.rank, title_highlight=hit.title_highlight, snippet=hit.snippet)
+            results.append(item)
+        return self.paginator.get_paginated_response(results)
+
+class PostDetail(SparseFieldsViewMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PostSerializer
+    sideload_authors = False
+    replica_reads = True
 
-class PostCommentList(generics.ListCreateAPIView):
+    def get_queryset(self):
+        return PostSerializer.setup_eager_loading(Post.objects.all(), self.request)
+
+    def retrieve(self, request, *args, **kwargs):
+        key = detail_cache_key(request, kwargs['pk'])
+        data = cache.get(key)
+        if data is None:
+            # Built on the primary for the same reason as PostList's pages.
+            with routers.primary():
+                data = dict(self.get_serializer(self.get_object()).data)
+            cache.set(key, data, cache_timeout())
+        return Response(merge_user_flags([data], request.user)[0])
+
+class PostCommentList(SparseFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    replica_reads = True
 
     def get_queryset(self):
         post_id = self.kwargs['pk']
-        return Comment.objects.filter(post_id=post_id).order_by('-created_at')
+        return Comment.objects.filter(post_id=post_id).select_related('author')
 
     def perform_create(self, serializer):
         post_id = self.kwargs['pk']
         post = Post.objects.get(pk=post_id)
-        serializer.save(author=self.request.user, post=post)
+        # The comment row and Post.number_of_comments change together.
+        with transaction.atomic():
+            serializer.save(author=self.request.user, post=post)
 
 class LikePost(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
         post = generics.get_object_or_404(Post, pk=pk)
-        like, created = LikedPost.objects.get_or_create(user=request.user, post=post)
-        
-        if created:
-            post.number_of_likes += 1
-            post.save()
-            return Response({'message': 'Post liked'}, status=status.HTTP_201_CREATED)
-        else:
-            like.delete()
-            post.number_of_likes -= 1
-            post.save()
+        with transaction.atomic():
+            like, created = LikedPost.objects.get_or_create(user=request.user, post=post)
+
+            if created:
+                Post.objects.filter(pk=post.pk).update(
+                    number_of_likes=F('number_of_likes') + 1, **score_changes(likes=1)
+                )
+                bump_post_versions(post.pk, post.department)
+                bump_user_version(request.user.pk)
+                return Response({'message': 'Post liked'}, status=status.HTTP_201_CREATED)
+
+            # Only the request that actually removed the row decrements.
+            deleted, _ = LikedPost.objects.filter(pk=like.pk).delete()
+            if deleted:
+                Post.objects.filter(pk=post.pk).update(
+                    number_of_likes=F('number_of_likes') - 1, **score_changes(likes=-1)
+                )
+                bump_post_versions(post.pk, post.department)
+                bump_user_version(request.user.pk)
             return Response({'message': 'Post unliked'}, status=status.HTTP_200_OK)
 
 class SavePost(APIView):
@@ -77,33 +204,68 @@ class SavePost(APIView):
 
     def post(self, request, pk):
         post = generics.get_object_or_404(Post, pk=pk)
-        saved_post, created = SavedPost.objects.get_or_create(user=request.user, post=post)
-        
+        # Like LikePost, so the version bump's after-commit half lands after
+        # the delete too.
+        with transaction.atomic():
+            saved_post, created = SavedPost.objects.get_or_create(user=request.user, post=post)
+            if not created:
+                saved_post.delete()
+            bump_user_version(request.user.pk)
+
         if created:
             return Response({'message': 'Post saved'}, status=status.HTTP_201_CREATED)
-        else:
-            saved_post.delete()
-            return Response({'message': 'Post unsaved'}, status=status.HTTP_200_OK)
+        return Response({'message': 'Post unsaved'}, status=status.HTTP_200_OK)
+
+class BatchPostActionsView(APIView):
+    """Apply a list of like / unlike / save / unsave actions in one transaction."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    class InputSerializer(serializers.Serializer):
+        post_id = serializers.IntegerField()
+        action = serializers.ChoiceField(choices=list(POST_ACTIONS))
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data, many=True, max_length=BATCH_MAX_ITEMS, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': apply_post_actions(request.user, serializer.validated_data)})
+
+class BatchDepartmentFollowView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    class InputSerializer(serializers.Serializer):
+        department = serializers.ChoiceField(choices=User.Department.values)
+        action = serializers.ChoiceField(choices=list(FOLLOW_ACTIONS))
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data, many=True, max_length=BATCH_MAX_ITEMS, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': apply_follow_actions(request.user, serializer.validated_data)})
 
-class UserLikedPosts(generics.ListAPIView):
+class UserLikedPosts(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.AllowAny]
+    cursor_ordering = ('-liked_id',)
+    replica_reads = True
 
     def get_queryset(self):
         username = self.kwargs['username']
         user = generics.get_object_or_404(User, username=username)
-        return Post.objects.filter(likedpost__user=user).order_by('-likedpost__id')
+        queryset = Post.objects.filter(likedpost__user=user).annotate(liked_id=F('likedpost__id'))
+        return PostSerializer.setup_eager_loading(queryset, self.request)
 
-class UserSavedPosts(generics.ListAPIView):
+class UserSavedPosts(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cursor_ordering = ('-saved_id',)
+    replica_reads = True
 
     def get_queryset(self):
         username = self.kwargs['username']
         if self.request.user.username != username:
              return Post.objects.none()
         user = generics.get_object_or_404(User, username=username)
-        return Post.objects.filter(savedpost__user=user).order_by('-savedpost__id')
+        queryset = Post.objects.filter(savedpost__user=user).annotate(saved_id=F('savedpost__id'))
+        return PostSerializer.setup_eager_loading(queryset, self.request)
 
 
 class ToggleDepartmentFollowView(APIView):
@@ -118,10 +280,12 @@ class ToggleDepartmentFollowView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        subscription, created = DepartmentSubscription.objects.get_or_create(
-            user=request.user,
-            department=department
-        )
+        # The timeline back-fill / trim runs in the subscription signals.
+        with transaction.atomic():
+            # Through the related manager, so the mask signals update request.user too.
+            subscription, created = request.user.subscriptions.get_or_create(department=department)
+            if not created:
+                subscription.delete()
 
         if created:
             return Response(
@@ -132,7 +296,6 @@ class ToggleDepartmentFollowView(APIView):
                 status=status.HTTP_200_OK
             )
 
-        subscription.delete()
         return Response(
             {
                 'department': department,
@@ -155,19 +318,99 @@ def social_login(request):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def NotificationsView(request):
-    notifications = Notification.objects.filter(
-        recipient=request.user
-    ).order_by('-created_at')
-
-    serializer = NotificationSerializer(notifications, many=True)
-    return Response(serializer.data)
+    parts, last_modified = notification_validators(request.user)
+    etag = make_etag(*parts, request.query_params.get('cursor'), request.query_params.get('page_size'))
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag, last_modified)
+
+    if pull_mode():
+        notifications = pull_notifications(request.user)
+        serializer_class = PostNotificationSerializer
+    else:
+        notifications = Notification.objects.filter(
+            recipient=request.user
+        ).select_related('post')
+        serializer_class = NotificationSerializer
+
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(notifications, request)
+    serializer = serializer_class(page, many=True)
+    return set_validators(paginator.get_paginated_response(serializer.data), etag, last_modified)
 
 class NotificationDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        if pull_mode():
+            return pull_notifications(self.request.user)
         return Notification.objects.filter(recipient=self.request.user)
+
+    def get_serializer_class(self):
+        if pull_mode():
+            return PostNotificationSerializer
+        return NotificationSerializer
+
+    def perform_destroy(self, instance):
+        # There is no row to delete in pull mode; dismissing marks it read.
+        if pull_mode():
+            mark_post_read(self.request.user, instance)
+        else:
+            instance.delete()
+
+class UnreadNotificationCountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response({'unread_count': unread_count(request.user)})
+
+class MarkNotificationsReadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    class InputSerializer(serializers.Serializer):
+        up_to = serializers.IntegerField(required=False, min_value=1)
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = mark_all_read(request.user, serializer.validated_data.get('up_to'))
+        return Response({'updated': updated})
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    privileged = True
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class ExportView(APIView):
+    """
+    Streams every row of posts / comments / likes / saves as NDJSON or CSV
+    (?output=csv), optionally filtered by ?department= and ?since= / ?until=.
+    """
+    permission_classes = [IsAdminUser]
+    privileged = True
+
+    class InputSerializer(serializers.Serializer):
+        output = serializers.ChoiceField(choices=list(export.FORMATS), default='ndjson')
+        department = serializers.ChoiceField(choices=User.Department.choices, required=False)
+        since = serializers.DateTimeField(required=False)
+        until = serializers.DateTimeField(required=False)
+
+    def get(self, request, kind):
+        if kind not in export.EXPORTS:
+            raise NotFound()
+        serializer = self.InputSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = dict(serializer.validated_data)
+        output = filters.pop('output')
+        content_type, extension = export.FORMATS[output]
+        response = StreamingHttpResponse(
+            export.render(kind, output, export.export_rows(kind, **filters)), content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{extension}"'
+        return response
     
 
 
@@ -197,6 +440,7 @@ class GoogleLogin(SocialLoginView):
 
 # New view to update user role
 class UpdateUserRoleView(APIView):
+    privileged = True
 
     class InputSerializer(serializers.Serializer):
         role = serializers.ChoiceField(choices=User.Role.choices)
@@ -211,16 +455,33 @@ class UpdateUserRoleView(APIView):
     
 class FollowedDepartmentsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    replica_reads = True
 
     def get(self, request, user_id):
-        followed = DepartmentSubscription.objects.filter(user_id=user_id).values_list('department', flat=True)
-        return Response(list(followed))
-class FollowedDepartmentsPostsView(generics.ListAPIView):
+        mask = User.objects.filter(pk=user_id).values_list('subscription_mask', flat=True).first()
+        return Response(subscribed_departments(mask or 0))
+class FollowedDepartmentsPostsView(SparseFieldsViewMixin, generics.ListAPIView):
+    # Not replica_reads: the page is validated by versions a write may
+    # already have bumped, so a stale replica read would be revalidated as
+    # current from then on.
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_followed_departments(self):
+        if not hasattr(self, '_followed_departments'):
+            self._followed_departments = sorted(subscribed_departments(self.request.user.subscription_mask))
+        return self._followed_departments
+
     def get_queryset(self):
-        followed_departments = DepartmentSubscription.objects.filter(
-            user=self.request.user
-        ).values_list('department', flat=True)
-        return Post.objects.filter(department__in=followed_departments).order_by('-created_at')
\ No newline at end of file
+        queryset, self.cursor_ordering = followed_queryset(
+            self.request.user, self.get_followed_departments(), self.cursor_ordering
+        )
+        return PostSerializer.setup_eager_loading(queryset, self.request)
+
+    def list(self, request, *args, **kwargs):
+        self.cursor_ordering = feed_ordering(request)
+        etag, last_modified = post_feed_validators(request, self.get_followed_departments())
+        response = not_modified(request, etag)
+        if response is not None:
+            return set_validators(response, etag, last_modified)
+        return set_validators(super().list(request, *args, **kwargs), etag, last_modified)
\ No newline at end of file